@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
+import asyncio
 import logging
 import logging.handlers
 import sys, traceback
 import contextlib
 import os
+import pathlib
 import platform
+import time
 import dotenv
 import discord
 
@@ -13,7 +16,10 @@ from dotenv import load_dotenv
 from datetime import datetime
 from discord.ext import commands
 from utilities.embeds import embed_error, set_style
-from utilities.db import create_tables, add_guild, remove_guild
+from utilities.intents import intents_profile
+from utilities.ipc import ClusterClient
+from utilities.prefixes import guild_prefixes
+from utilities.db import init_database, close_pool, create_tables, guild_settings, reaction_roles, add_guild, remove_guild
 
 # This program requires the use of Python 3.6 or higher due to the use of f-strings.
 # Compatibility with Python 3.5 is possible if f-strings are removed.
@@ -27,6 +33,18 @@ load_dotenv(dotenv_path)
 token = os.getenv('DISCORD_TOKEN')
 version = os.getenv('VERSION')
 
+# Sharding set-up. Without SHARD_COUNT a single connection handles every guild.
+# SHARD_COUNT=auto lets Discord choose the number of shards, SHARD_IDS (e.g. 0,1,2) runs only some of them in this process.
+# launcher.py uses them to spread the shards over several processes, each one with its own CLUSTER_ID.
+shard_count = os.getenv('SHARD_COUNT')
+shard_ids = os.getenv('SHARD_IDS')
+cluster_id = os.getenv('CLUSTER_ID')
+
+# Cogs loaded at start-up, e.g. COGS=Members,Moderation,Utility. Every cog in the cogs folder is loaded when it is empty.
+# Heavy libraries such as wavelink are only imported by the cogs which use them, so leaving those cogs out skips them too.
+cogs_path = pathlib.Path(__file__).resolve().parent / 'cogs'
+enabled_cogs = [cog.strip() for cog in os.getenv('COGS', '').split(',') if cog.strip()]
+
 @contextlib.contextmanager # No need to define __enter__() and __exit__() methods.
 def logger():
     '''Creates different loggers to keep track of everything.'''
@@ -41,9 +59,11 @@ def logger():
         # We only need one handler for all the logs.
         if not os.path.exists(f'logs/{log_name}'):
             os.makedirs(f'logs/{log_name}')
-        handler = logging.handlers.RotatingFileHandler(filename=f'logs/{log_name}/{log_name}.log', mode='w', backupCount=5, encoding='utf-8', maxBytes=2**22)
+        # Every cluster writes its own log files.
+        filename = f'logs/{log_name}/{log_name}.log' if cluster_id is None else f'logs/{log_name}/{log_name}-{cluster_id}.log'
+        handler = logging.handlers.RotatingFileHandler(filename=filename, mode='w', backupCount=5, encoding='utf-8', maxBytes=2**22)
         handler.setFormatter(logging.Formatter('%(asctime)s %(name)s: %(levelname)s: %(message)s', datefmt='%d/%m/%Y %H:%M:%S'))
-        if os.path.isfile(f'logs/{log_name}/{log_name}.log'):
+        if os.path.isfile(filename):
             handler.doRollover()
         log.addHandler(handler)
 
@@ -66,57 +86,98 @@ def get_prefix(bot, message):
     bot -- the bot object 
     message -- message in the contect '''
 
-    # Notice how you can use spaces in prefixes. Try to keep them simple though.
-    prefixes = ['!', '? ', '.']
-
     # Check to see if we are outside of a guild. e.g DM's etc.
     if not message.guild:
         # Only allow ! to be used in DMs
         return '!'
 
-    # If we are in a guild, we allow for the user to mention us or use any of the prefixes in our list.
-    return commands.when_mentioned_or(*prefixes)(bot, message)
+    # If we are in a guild, we allow for the user to mention us or use any of the prefixes of the guild (see utilities/prefixes.py).
+    # Only the prefix which matched is returned, so discord.py does not need to try every prefix again.
+    # Without a match the message does not start with any prefix of the guild, so returning the first one just fails the check.
+    prefix = guild_prefixes.match(message.guild.id, bot.user.id, message.content)
+    return prefix if prefix is not None else guild_prefixes.get(message.guild.id)[0]
 
-intents = discord.Intents.all()
+profile = os.getenv('INTENTS_PROFILE', 'full')
+intents, member_cache_flags, chunk_guilds = intents_profile(profile)
 
 description = '''Shuwy is a bot written by `Shunya#1624`. It implements basic moderation functions, automation and music.'''
-bot = commands.Bot(command_prefix = get_prefix, owner_id = 125345019199488000, case_insensitive = True, description = description, intents = intents)
+options = dict(command_prefix = get_prefix, owner_id = 125345019199488000, case_insensitive = True, description = description, intents = intents,
+               member_cache_flags = member_cache_flags, chunk_guilds_at_startup = chunk_guilds)
+if shard_count:
+    bot = commands.AutoShardedBot(**options, shard_count = None if shard_count == 'auto' else int(shard_count),
+                                  shard_ids = [int(shard) for shard in shard_ids.split(',')] if shard_ids else None)
+else:
+    bot = commands.Bot(**options)
 
 bot.version = version
+bot.cluster_id = cluster_id
+bot.intents_profile = profile
+
+# Clusters started by launcher.py talk to each other through the supervisor, e.g. to count every guild or reload every cluster.
+ipc_address = os.getenv('CLUSTER_IPC_ADDRESS')
+bot.cluster = ClusterClient(bot.loop, int(cluster_id), ipc_address, bytes.fromhex(os.getenv('CLUSTER_IPC_KEY'))) if ipc_address else None
 bot.log =logging.getLogger('bot')
 
-@bot.event
-async def on_connect():
-    '''Event that takes place when the bot has successfully connected to Discord
-       Loads cogs and initializes the database when it does not exist.'''
+def load_cogs():
+    '''Loads the enabled cogs once, before logging in, and logs how long each one takes, imports included.'''
 
     print('Shuwy is starting up...')
     print('-------------------------------')
     print('Loading Cogs...')
-    for cog in os.listdir('.\\cogs'):
-        if cog.endswith('.py'):
-            try:
-                cog = f'cogs.{cog.replace(".py", "")}'
-                bot.load_extension(cog)
-            except Exception as e:
-                print(f'Could not load extension: {e}')
-    print('Finished loading Cogs.')
+    available = sorted(path.stem for path in cogs_path.glob('*.py'))
+    for cog in enabled_cogs:
+        if cog not in available:
+            print(f'Could not find the cog {cog}.')
+
+    started = time.perf_counter()
+    for cog in enabled_cogs or available:
+        if cog not in available:
+            continue
+        name = f'cogs.{cog}'
+        try:
+            begin = time.perf_counter()
+            bot.load_extension(name)
+            loaded = time.perf_counter()
+        except Exception as e:
+            print(f'Could not load extension: {e}')
+            bot.log.error(f'Could not load extension {name}: {e}')
+            continue
+        bot.log.info(f'Cog {cog} loaded in {(loaded - begin) * 1000:.1f} ms')
+    total = (time.perf_counter() - started) * 1000
+    print(f'Finished loading Cogs in {total:.0f} ms.')
     print('-------------------------------')
+    bot.log.info(f'Finished loading {len(bot.extensions)} cogs in {total:.1f} ms')
+
+async def startup():
+    '''Prepares everything the cogs need before logging in: the database, its caches and the connection to the other clusters.'''
+
+    await init_database()
     await create_tables()
+    await asyncio.gather(guild_settings.load(), reaction_roles.load(), guild_prefixes.load())
+    if bot.cluster is not None:
+        await bot.cluster.connect()
+
+@bot.event
+async def on_connect():
+    '''Event that takes place when the bot has successfully connected to Discord.
+       It fires again on every reconnection, so nothing is loaded here.'''
+
+    bot.log.info('Connected to Discord.')
 
 @bot.event
 async def on_guild_join(guild):
     '''Event that takes place when the bot joins a server.
        Initializes the necessary server parameters in the database.'''
 
-    add_guild(guild)
+    await add_guild(guild.id)
 
 @bot.event
 async def on_guild_remove(guild):
     '''Event that takes place when the bot leaves a server.
        Removes the previously created server parameters in the database.'''
 
-    remove_guild(guild)
+    await remove_guild(guild.id)
+    await guild_prefixes.clear(guild.id)
 
 @bot.event
 async def on_ready():
@@ -124,15 +185,38 @@ async def on_ready():
 
     print(f'Succesfully logged in as {bot.user}')
     print(f'• ID: {bot.user.id}')
+    if bot.shard_count:
+        print(f'• Shards: {", ".join(map(str, sorted(bot.shards)))} of {bot.shard_count}' + (f' (cluster {cluster_id})' if cluster_id else ''))
     print(f'• Shuwy version: {bot.version}')
     print(f'• Discord.py version: {discord.__version__}')
     print(f'• Python version: {platform.python_version()}')
     print('-------------------------------')
 
+    # Forget the settings of the guilds the bot was removed from while it was offline.
+    guild_settings.retain(guild.id for guild in bot.guilds)
+
     # TO-DO: Change the following line to not include it in the on_ready event. 
     await bot.change_presence(activity=discord.Activity(name=f'!help for info', type=1))
     print(f'Successfully logged in and booted!')
 
+async def cleanup():
+    '''Closes the database once the bot has logged out. Logging out unloads the cogs, so their last writes are waited for first.'''
+
+    snapshot = getattr(bot, 'music_snapshot', None)
+    if snapshot is not None:
+        await asyncio.wait([snapshot])
+    await close_pool()
+
 if __name__ == '__main__':
     with logger():
-        bot.run(token, bot=True, reconnect=True)
\ No newline at end of file
+        load_cogs()
+        bot.loop.run_until_complete(startup())
+        # bot.run() would close the event loop as soon as the bot logs out, so the bot is started by hand to close the
+        # database afterwards.
+        try:
+            bot.loop.run_until_complete(bot.start(token, bot=True, reconnect=True))
+        except KeyboardInterrupt:
+            bot.loop.run_until_complete(bot.logout())
+        finally:
+            bot.loop.run_until_complete(cleanup())
+            bot.loop.close()
\ No newline at end of file
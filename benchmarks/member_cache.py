@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+
+from discord.state import ConnectionState
+from utilities.intents import intents_profile
+
+# Compares the memory used by the member cache of the intents profiles (INTENTS_PROFILE) without connecting to Discord.
+# A fake large guild goes through discord.py's own gateway handlers: the GUILD_CREATE payload with the online members,
+# the member chunks requested at start-up by the profiles which chunk, some members joining and some joining a voice channel.
+#
+# Usage: python benchmarks/member_cache.py [--members 50000] [--online 1000] [--joins 500] [--voice 100]
+
+guild_id = 1 << 40
+voice_channel_id = guild_id + 1
+bot_id = guild_id + 2
+
+def user(user_id):
+    return {'id': str(user_id), 'username': f'user{user_id}', 'discriminator': f'{user_id % 10000:04}', 'avatar': None}
+
+def member(user_id):
+    return {'user': user(user_id), 'roles': [], 'joined_at': '2020-10-07T00:00:00+00:00', 'deaf': False, 'mute': False}
+
+def presence(user_id):
+    return {'user': {'id': str(user_id)}, 'status': 'online', 'activities': [], 'client_status': {'desktop': 'online'}}
+
+def voice_state(user_id):
+    return {'guild_id': str(guild_id), 'channel_id': str(voice_channel_id), 'user_id': str(user_id), 'member': member(user_id),
+            'session_id': 'session', 'deaf': False, 'mute': False, 'self_deaf': False, 'self_mute': False, 'suppress': False}
+
+def guild_create(args):
+    online = range(1, args.online + 1)
+    return {'id': str(guild_id), 'name': 'Benchmark', 'large': True, 'member_count': args.members, 'roles': [], 'emojis': [],
+            'channels': [{'id': str(voice_channel_id), 'type': 2, 'name': 'Music', 'position': 0, 'bitrate': 64000, 'user_limit': 0}],
+            'members': [member(user_id) for user_id in online], 'presences': [presence(user_id) for user_id in online],
+            'voice_states': []}
+
+def fill_guild(name, args):
+    '''Builds the connection state of a profile and feeds it the events of the fake guild. Returns the guild.'''
+
+    intents, member_cache_flags, chunk_guilds = intents_profile(name)
+    state = ConnectionState(dispatch=lambda *args, **kwargs: None, handlers={}, hooks={}, syncer=None, http=None,
+                            loop=asyncio.get_event_loop(), intents=intents, member_cache_flags=member_cache_flags,
+                            chunk_guilds_at_startup=chunk_guilds)
+    state.user = discord.ClientUser(state=state, data=user(bot_id))
+    guild = state._add_guild_from_data(guild_create(args))
+
+    if chunk_guilds:
+        # What the chunk requests sent at start-up add to the cache, see discord.state.ChunkRequest.
+        for user_id in range(1, args.members + 1):
+            guild._add_member(discord.Member(data=member(user_id), guild=guild, state=state))
+
+    first = args.members + 1
+    for user_id in range(first, first + args.joins):
+        state.parse_guild_member_add(dict(member(user_id), guild_id=str(guild_id)))
+    for user_id in range(args.online + 1, args.online + 1 + args.voice):
+        state.parse_voice_state_update(voice_state(user_id))
+    return guild
+
+def measure(name, args):
+    gc.collect()
+    tracemalloc.start()
+    guild = fill_guild(name, args)
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(guild.members), size, peak
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory used by the member cache of each intents profile.')
+    parser.add_argument('--members', type=int, default=50000, help='members of the guild')
+    parser.add_argument('--online', type=int, default=1000, help='members sent with the guild when it becomes available')
+    parser.add_argument('--joins', type=int, default=500, help='members joining after start-up')
+    parser.add_argument('--voice', type=int, default=100, help='members joining the voice channel')
+    args = parser.parse_args()
+
+    print(f'{args.members} members, {args.online} online, {args.joins} joins, {args.voice} in voice')
+    for name in ('full', 'minimal'):
+        members, size, peak = measure(name, args)
+        print(f'{name:>8}: {members:>7} cached members, {size / 2**20:7.1f} MiB ({peak / 2**20:.1f} MiB peak)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.prefixes import GuildPrefixes
+
+# Times the prefix matching done by get_prefix on every message, for a guild with the default prefixes and one with
+# custom prefixes: a command (match), a normal chat message (miss) and a mention of the bot.
+#
+# Usage: python benchmarks/prefixes.py [--number 200000]
+
+bot_id = 1 << 40
+default_guild = 1
+custom_guild = 2
+
+cases = [
+    ('match', '!play never gonna give you up', '$$play never gonna give you up'),
+    ('miss', 'just chatting in a channel about music', 'just chatting in a channel about music'),
+    ('mention', f'<@!{bot_id}> help', f'<@!{bot_id}> help'),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description='Time per message of the prefix matching.')
+    parser.add_argument('--number', type=int, default=200000, help='messages matched per case')
+    args = parser.parse_args()
+
+    prefixes = GuildPrefixes()
+    # Custom prefixes as GuildPrefixes.load() reads them from the database, without needing one.
+    prefixes._prefixes[custom_guild] = ('$', '$$', 'shuwy ', '>>', '?')
+
+    for guild, name in ((default_guild, 'default'), (custom_guild, 'custom')):
+        for case, default_content, custom_content in cases:
+            content = default_content if guild == default_guild else custom_content
+            result = prefixes.match(guild, bot_id, content)
+            seconds = timeit.timeit(lambda: prefixes.match(guild, bot_id, content), number=args.number)
+            print(f'{name:>8} {case:>8}: {seconds / args.number * 1e9:6.0f} ns per message, prefix {result!r}')
+
+if __name__ == '__main__':
+    main()
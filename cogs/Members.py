@@ -1,16 +1,154 @@
+import asyncio
+import collections
 import re
 import datetime
 import discord
+import os
+import time
 
 from discord.ext import commands
 from utilities.embeds import *
 from utilities.db import *
+from utilities.prefixes import guild_prefixes, max_prefixes, max_prefix_length
+
+# Custom emoji matching REGEX, e.g. <:name:123> or <a:name:123> for animated ones...
+CUSTOM_EMOJI_REG = re.compile(r'<a?:\w+:(\d+)>')
+
+class RoleQueue:
+    '''Pending role changes of the members of a guild.
+
+    Changes are coalesced per member: only the last requested state of each role is kept,
+    so an add followed by a remove of the same role cancels out. The queue is drained one member at a time,
+    applying only the changes which are still needed and pausing after each member that needed any, so that
+    a burst of reactions does not run into Discord's rate limits.'''
+
+    def __init__(self, cog, guild_id):
+        self.cog = cog
+        self.guild_id = guild_id
+        self.pending = collections.OrderedDict() # member ID -> ({role ID: add}, time of the first change)
+        self.task = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, member_id, role_id, add):
+        '''Queues adding (add=True) or removing (add=False) a role to a member.'''
+
+        entry = self.pending.get(member_id)
+        if entry is None:
+            entry = self.pending[member_id] = ({}, time.monotonic())
+        elif role_id in entry[0]:
+            self.cog.role_stats['coalesced'] += 1
+        entry[0][role_id] = add
+        self.cog.role_stats['queued'] += 1
+
+        if self.task is None or self.task.done():
+            self.task = self.cog.bot.loop.create_task(self.drain())
+
+    async def drain(self):
+        '''Applies the pending changes, oldest member first, until the queue is empty.'''
+
+        while self.pending:
+            member_id, (changes, queued_at) = self.pending.popitem(last=False)
+            try:
+                sent = await self.apply(member_id, changes)
+            except discord.HTTPException as e:
+                sent = True
+                if e.status != 429:
+                    self.cog.bot.log.warning(f'Could not update the roles of member {member_id} in guild {self.guild_id}: {e}')
+                else:
+                    # Still rate limited after discord.py's own retries: put the changes back, newer ones win, and back off.
+                    entry = self.pending.setdefault(member_id, ({}, queued_at))
+                    for role_id, add in changes.items():
+                        entry[0].setdefault(role_id, add)
+                    self.pending.move_to_end(member_id, last=False)
+                    await asyncio.sleep(self.cog.role_interval * 10)
+                    continue
+            self.cog.record_role_drain(time.monotonic() - queued_at)
+            if sent:
+                await asyncio.sleep(self.cog.role_interval)
+
+    async def apply(self, member_id, changes):
+        '''Adds and removes the roles of a member which still need it. Returns whether any request was sent.'''
+
+        guild = self.cog.bot.get_guild(self.guild_id)
+        if guild is None:
+            return False
+        member = guild.get_member(member_id)
+        if member is None:
+            try:
+                member = await guild.fetch_member(member_id)
+            except discord.NotFound:
+                return False
+
+        current = set(role.id for role in member.roles)
+        added = [discord.Object(id=role_id) for role_id, add in changes.items()
+                 if add and role_id not in current and guild.get_role(role_id) is not None]
+        removed = [discord.Object(id=role_id) for role_id, add in changes.items() if not add and role_id in current]
+
+        if not added and not removed:
+            self.cog.role_stats['skipped'] += 1
+            return False
+        # Role by role rather than sending the whole role list, which would undo the changes the cache has not seen yet,
+        # e.g. the welcome role added when the member joined.
+        if added:
+            await member.add_roles(*added, reason='Reaction roles')
+        if removed:
+            await member.remove_roles(*removed, reason='Reaction roles')
+        self.cog.role_stats['applied'] += 1
+        return True
 
 class MembersCog(commands.Cog, name='Members'):
     '''Cog in charge of the functions related to members, roles and permissions.'''
 
     def __init__(self, bot):
         self.bot = bot
+        self.role_queues = {} # guild ID -> RoleQueue
+        self.role_interval = float(os.getenv('ROLE_QUEUE_INTERVAL', 0.5))
+        self.role_stats = {'queued': 0, 'coalesced': 0, 'applied': 0, 'skipped': 0, 'drained': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+
+    def cog_unload(self):
+        '''Stops draining the role queues when the cog is unloaded.'''
+
+        for queue in self.role_queues.values():
+            if queue.task is not None:
+                queue.task.cancel()
+
+    def queue_role(self, guild_id, member_id, role_id, add):
+        '''Queues a role change in the role queue of a guild.
+
+        Keyword arguments:
+        guild_id -- ID of the guild of the member
+        member_id -- ID of the member whose roles change
+        role_id -- ID of the role to be added or removed
+        add -- True to add the role, False to remove it'''
+
+        queue = self.role_queues.get(guild_id)
+        if queue is None:
+            queue = self.role_queues[guild_id] = RoleQueue(self, guild_id)
+        queue.push(member_id, role_id, add)
+
+    def record_role_drain(self, latency):
+        '''Keeps track of the time between a role change being queued and applied.'''
+
+        self.role_stats['drained'] += 1
+        self.role_stats['latency_total'] += latency
+        self.role_stats['latency_max'] = max(self.role_stats['latency_max'], latency)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def rolequeue(self, ctx):
+        '''Shows the counters of the reaction role queues.'''
+
+        stats = self.role_stats
+        depth = sum(len(queue) for queue in self.role_queues.values())
+        average = stats['latency_total'] / stats['drained'] if stats['drained'] else 0
+        embed = discord.Embed(title='Reaction Role Queues', color=discord.Colour.purple())
+        embed.add_field(name='Queue depth', value=f'{depth} members in {sum(1 for queue in self.role_queues.values() if queue)} guilds')
+        embed.add_field(name='Changes', value=f'{stats["queued"]} queued, {stats["coalesced"]} coalesced')
+        embed.add_field(name='Requests', value=f'{stats["applied"]} sent, {stats["skipped"]} skipped')
+        embed.add_field(name='Drain latency', value=f'{average:.2f}s average, {stats["latency_max"]:.2f}s max')
+        await ctx.send(embed=set_style(embed))
 
     @commands.command(name='joined', aliases=['unido', 'entered'])
     async def joined(self, ctx, *, member: discord.Member=None):
@@ -55,6 +193,60 @@ class MembersCog(commands.Cog, name='Members'):
         embed.add_field(name='\uFEFF', value=perms)
         await ctx.send(content=None, embed=set_style(embed))
 
+    @commands.group(invoke_without_command=True)
+    @commands.guild_only()
+    async def prefix(self, ctx):
+        '''Shows the command prefixes of the server.
+           Its subcommands change them.'''
+
+        prefixes = '\n'.join(f'`{prefix}`' for prefix in guild_prefixes.get(ctx.guild.id))
+        embed = discord.Embed(color=discord.Colour.purple(), title='Prefixes:', description=f'{prefixes}\n\nprefix add <prefix>\nprefix remove <prefix>\nprefix reset')
+        return await ctx.send(embed=set_style(embed))
+
+    @prefix.command(name='add')
+    @commands.has_permissions(manage_guild=True)
+    async def prefix_add(self, ctx, prefix: str):
+        '''Subcommand to add a command prefix. Use quotes for prefixes ending with a space.
+
+        Keyword arguments:
+        prefix -- the new prefix'''
+
+        prefixes = guild_prefixes.get(ctx.guild.id)
+        if not 0 < len(prefix) <= max_prefix_length or prefix in prefixes or len(prefixes) >= max_prefixes:
+            embed = discord.Embed(color=discord.Colour.purple(), description=f'Prefixes must be new, up to {max_prefix_length} characters long, and a server can have at most {max_prefixes}.')
+            return await ctx.send(embed=set_style(embed))
+
+        await guild_prefixes.set(ctx.guild.id, prefixes + (prefix, ))
+        embed = discord.Embed(color=discord.Colour.purple(), description=f'Prefix `{prefix}` has been added.')
+        return await ctx.send(embed=set_style(embed))
+
+    @prefix.command(name='remove')
+    @commands.has_permissions(manage_guild=True)
+    async def prefix_remove(self, ctx, prefix: str):
+        '''Subcommand to remove a command prefix. Mentioning the bot always works as a prefix.
+
+        Keyword arguments:
+        prefix -- the prefix to remove'''
+
+        prefixes = guild_prefixes.get(ctx.guild.id)
+        if prefix not in prefixes or len(prefixes) == 1:
+            embed = discord.Embed(color=discord.Colour.purple(), description=f'`{prefix}` is not a prefix of this server, or it is the last one.')
+            return await ctx.send(embed=set_style(embed))
+
+        await guild_prefixes.set(ctx.guild.id, [other for other in prefixes if other != prefix])
+        embed = discord.Embed(color=discord.Colour.purple(), description=f'Prefix `{prefix}` has been removed.')
+        return await ctx.send(embed=set_style(embed))
+
+    @prefix.command(name='reset')
+    @commands.has_permissions(manage_guild=True)
+    async def prefix_reset(self, ctx):
+        '''Subcommand to go back to the default prefixes.'''
+
+        await guild_prefixes.clear(ctx.guild.id)
+        prefixes = ' '.join(f'`{prefix}`' for prefix in guild_prefixes.get(ctx.guild.id))
+        embed = discord.Embed(color=discord.Colour.purple(), description=f'Prefixes have been reset to {prefixes}')
+        return await ctx.send(embed=set_style(embed))
+
     @commands.group(invoke_without_commands=True)
     @commands.has_permissions(manage_messages=True)
     async def welcome(self, ctx):
@@ -83,7 +275,7 @@ class MembersCog(commands.Cog, name='Members'):
         Keyword arguments:
         text -- message to be used as welcome messages'''
 
-        await set_welcome_message(text, ctx.guild.id)
+        await set_welcome_text(text, ctx.guild.id)
         embed = discord.Embed(color=discord.Colour.purple(), description=f'Welcome Message has been set to `{text}`')
         return await ctx.send(embed=set_style(embed))
    
@@ -126,7 +318,7 @@ class MembersCog(commands.Cog, name='Members'):
     async def role_off(self, ctx):
         '''Subcommand to deactivate the welcome role.'''
 
-        welcome_role_switch(0, ctx.guild.id)
+        await welcome_role_switch(0, ctx.guild.id)
         embed = discord.Embed(color=discord.Colour.purple(), description='Welcome Role has been deactivated.')
         return await ctx.send(embed=set_style(embed))
 
@@ -136,111 +328,63 @@ class MembersCog(commands.Cog, name='Members'):
            Here we will read the database and assign the member the necessary settings. '''
 
         guild = member.guild
-        result0 = await get_welcome_channel_switch(member.guild.id)
-        if result0[0] is 1:
-            result = await get_welcome_channel_id(member.guild.id)
-            if result[0] is None:
-                if guild.system_channel is not None:
-                    sql = ("UPDATE welcome SET welcome_channel_id = ? WHERE guild_id = ?")
-                    val = (guild.system_channel.id, guild.id)
-                    await cursor.execute(sql, val)
-                    channel = discord.utils.get(guild.text_channels, id=guild.system_channel.id)
-                    result1 = await get_welcome_message(member.guild.id)
-                    if result1[0] is None:
-                        msg = 'Hello {mention}! Welcome to {guild}'
-                        await channel.send(embed=embed_welcome(msg, member))
-                    else:
-                        await channel.send(embed=embed_welcome(str(result1[0]), member))
-                else:
+        settings = await get_guild_settings(guild.id)
+        if settings is None:
+            return
+        if settings.welcome_channel_on == 1:
+            if settings.welcome_channel_id is None:
+                if guild.system_channel is None:
                     return
+                await set_welcome_channel(guild.system_channel.id, guild.id)
+                channel = guild.system_channel
             else:
-                channel = discord.utils.get(guild.text_channels, id=int(result[0]))
-                result1 = await get_welcome_message(member.guild.id)
-                if result1[0] is None:
-                    msg = 'Hello {mention}! Welcome to {guild}'
-                    await channel.send(embed=embed_welcome(msg, member))
-                else:
-                    await channel.send(embed=embed_welcome(str(result1[0]), member))
-        result2 = await get_welcome_role_switch(member.guild.id)
-        if result2[0] is 1:
-            result3 = await get_welcome_role_id(member.guild.id)
-            if result3[0] is None:
+                channel = discord.utils.get(guild.text_channels, id=settings.welcome_channel_id)
+            if settings.welcome_msg is None:
+                msg = 'Hello {mention}! Welcome to {guild}'
+                await channel.send(embed=embed_welcome(msg, member))
+            else:
+                await channel.send(embed=embed_welcome(str(settings.welcome_msg), member))
+        if settings.welcome_role_on == 1:
+            if settings.welcome_role_id is None:
                 role_Name = 'New Member'
-                await guild.create_role(name=role_Name)
-                role = discord.utils.get(guild.roles, name = role_Name)
-                sql = ("UPDATE welcome SET welcome_role_id = ? WHERE guild_id = ?")
-                val = (role.id, guild.id)
-                await cursor.execute(sql, val)
-                await database.commit()
+                role = await guild.create_role(name=role_Name)
+                await set_welcome_role(role.id, guild.id)
                 await member.add_roles(role)
             else:
-                role = guild.get_role(role_id=int(result3[0]))
+                role = guild.get_role(role_id=settings.welcome_role_id)
                 await member.add_roles(role)
-        await commit_and_close(database, cursor)
 
+    def emoji_key(self, emoji):
+        '''Returns the key used for an emoji in the reaction roles: the ID of custom emojis, the emoji itself otherwise.
+
+        Keyword arguments:
+        emoji -- PartialEmoji of a reaction, or the emoji text written in a command'''
+
+        if isinstance(emoji, discord.PartialEmoji):
+            return str(emoji.id) if emoji.id else str(emoji)
+        custom = CUSTOM_EMOJI_REG.fullmatch(emoji)
+        return custom.group(1) if custom else emoji
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, reaction):
         '''Event that takes places when a reaction is added to a message.'''
 
-        database = await db_connect()
-        cursor = await database.cursor()
-        if '<:' in str(reaction.emoji):
-            await cursor.execute(f"SELECT emoji, role, message_id, channel_id FROM reaction WHERE guild_id = '{reaction.guild_id}' and message_id = '{reaction.message_id}' and emoji = '{reaction.emoji.id}'")
-            result = await cursor.fetchone()
-            guild = self.bot.get_guild(reaction.guild_id)
-            if str(reaction.emoji.id) in str(result[0]):
-                on = discord.utils.get(guild.roles, id=int(result[1]))
-                user = guild.get_member(reaction.user_id)
-                await user.add_roles(on)
-            else:
-                return
-        else:
-            await cursor.execute(f"SELECT emoji, role, message_id, channel_id FROM reaction WHERE guild_id = '{reaction.guild_id}' and message_id = '{reaction.message_id}' and emoji = '{reaction.emoji}'")
-            result = await cursor.fetchone()
-            guild = self.bot.get_guild(reaction.guild_id)
-            if result is not None:
-                on = discord.utils.get(guild.roles, id=int(result[1]))
-                user = guild.get_member(reaction.user_id)
-                await user.add_roles(on)
-            else:
-                return
-        await database.commit()
-        await cursor.close()
-        await database.close()
+        role_id = reaction_roles.get(reaction.message_id, self.emoji_key(reaction.emoji))
+        if role_id is None or reaction.user_id == self.bot.user.id:
+            return
+        self.queue_role(reaction.guild_id, reaction.user_id, role_id, True)
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, reaction):
         '''Event that takes places when a reaction is deleted from a message.'''
 
-        database = await db_connect()
-        cursor = await database.cursor()
-        if '<:' in str(reaction.emoji):
-            await cursor.execute(f"SELECT emoji, role, message_id, channel_id FROM reaction WHERE guild_id = '{reaction.guild_id}' and message_id = '{reaction.message_id}' and emoji = '{reaction.emoji.id}'")
-            result = await cursor.fetchone()
-            guild = self.bot.get_guild(reaction.guild_id)
-            if str(reaction.emoji.id) in str(result[0]):
-                on = discord.utils.get(guild.roles, id=int(result[1]))
-                user = guild.get_member(reaction.user_id)
-                await user.remove_roles(on)
-            else:
-                return
-        else:
-            await cursor.execute(f"SELECT emoji, role, message_id, channel_id FROM reaction WHERE guild_id = '{reaction.guild_id}' and message_id = '{reaction.message_id}' and emoji = '{reaction.emoji}'")
-            result = await cursor.fetchone()
-            guild = self.bot.get_guild(reaction.guild_id)
-            if result is not None:
-                on = discord.utils.get(guild.roles, id=int(result[1]))
-                user = guild.get_member(reaction.user_id)
-                await user.remove_roles(on)
-            else:
-                return
-        await database.commit()
-        await cursor.close()
-        await database.close()
+        role_id = reaction_roles.get(reaction.message_id, self.emoji_key(reaction.emoji))
+        if role_id is None or reaction.user_id == self.bot.user.id:
+            return
+        self.queue_role(reaction.guild_id, reaction.user_id, role_id, False)
 
     @commands.command()
-    async def role_add(self, ctx, channel:discord.TextChannel, messageid, emoji, role:discord.Role):
+    async def role_add(self, ctx, channel:discord.TextChannel, messageid:int, emoji, role:discord.Role):
         '''Sets a role to be added to a user when he reacts to a pre-defined message with a pre-defined role.
 
         Keyword arguments:
@@ -249,64 +393,28 @@ class MembersCog(commands.Cog, name='Members'):
         emoji -- emoji to be used
         role -- role to be added to the user'''
 
-        database = await db_connect()
-        cursor = await database.cursor()
-        await cursor.execute(f"SELECT emoji, role, message_id, channel_id FROM reaction WHERE guild_id = '{ctx.message.guild.id}' and message_id = '{messageid}'")
-        result = await cursor.fetchone()
-        if '<:' in emoji:
-            emm = re.sub(':.*?', '', emoji).strip('<>')
-            if result is None or str(message_id) not in str(result[3]):
-                sql = ("INSERT INTO reaction(emoji, role, message_id, channel_id, guild_id) VALUES(?,?,?,?,?)")
-                val = (emm, role.id, messageid, channel.id, ctx.guild.id)
-                await cursor.execute(sql, val)
-                msg = await channel.fetch_message(messageid)
-                em = self.bot.get_emoji(int(emm))
-                await msg.add_reaction(em)
+        key = self.emoji_key(emoji)
+        await add_reaction_role(key, role.id, messageid, channel.id, ctx.guild.id)
+        msg = await channel.fetch_message(messageid)
+        if key != emoji:
+            await msg.add_reaction(self.bot.get_emoji(int(key)))
         else:
-            if result is None or str(message_id) not in str(result[3]):
-                sql = ("INSERT INTO reaction(emoji, role, message_id, channel_id, guild_id) VALUES(?,?,?,?,?)")
-                val = (emoji, role.id, messageid, channel.id, ctx.guild.id)
-                await cursor.execute(sql, val)
-                msg = await channel.fetch_message(messageid)
-                await msg.add_reaction(emoji)
-        await database.commit()
-        await cursor.close()
-        await database.close()
+            await msg.add_reaction(emoji)
 
     @commands.command()
-    async def role_remove(self, ctx, messageid=None, emoji=None):
+    async def role_remove(self, ctx, messageid:int=None, emoji=None):
         '''Use it after using role_add to make the bot remove the emoji and stop adding the role to the person reacting to it.
 
         Keyword arguments:
         messageid -- ID of the message where the bot had reacted
         emoji -- emoji used'''
 
-        database = await db_connect()
-        cursor = await database.cursor()
-        await cursor.execute(f"SELECT emoji, role, message_id, channel_id FROM reaction WHERE guild_id = '{ctx.message.guild.id}' and message_id = '{messageid}'")
-        result = await cursor.fetchone()
-        if '<:' in emoji:
-            emm = re.sub(':.*?', '', emoji).strip('<>')
-            if result is None:
-                await ctx.send(embed=embed_error('That reaction was not found on that message.', input1=ctx))
-            elif str(messageid) in str(result[2]):
-                await cursor.execute(f"DELETE FROM reaction WHERE guild_id = '{ctx.message.guild.id}' and message_id = '{messageid}' and emoji = '{emm}'")
-                embed = discord.Embed(description='Reaction has been removed.', color=discord.Colour.purple())  
-                await ctx.send(embed=set_style(embed))
-            else:
-                await ctx.send(embed=embed_error('That reaction was not found on that message.', input1=ctx))
-        else:
-            if result is None:
-                await ctx.send(embed=embed_error('That reaction was not found on that message.', input1=ctx))
-            elif str(messageid) in str(result[2]):
-                await cursor.execute(f"DELETE FROM reaction WHERE guild_id = '{ctx.message.guild.id}' and message_id = '{messageid}' and emoji = '{emoji}'")
-                embed = discord.Embed(description='Reaction has been removed.', color=discord.Colour.purple())  
-                await ctx.send(embed=set_style(embed))
-            else:
-                await ctx.send(embed=embed_error('That reaction was not found on that message.', input1=ctx))
-        await database.commit()
-        await cursor.close()
-        await database.close()
+        key = self.emoji_key(emoji) if emoji else None
+        # Only the reaction roles of this guild are removed, the rowcount tells whether there was one.
+        if key is None or messageid is None or not await remove_reaction_role(key, messageid, ctx.guild.id):
+            return await ctx.send(embed=embed_error('That reaction was not found on that message.', input1=ctx))
+        embed = discord.Embed(description='Reaction has been removed.', color=discord.Colour.purple())  
+        await ctx.send(embed=set_style(embed))
 
     async def cog_check(self, ctx: commands.Context):
         '''Cog wide check, which disallows commands in DMs.'''
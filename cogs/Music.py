@@ -1,18 +1,25 @@
 import asyncio
 import async_timeout
+import collections
 import copy
 import datetime
 import discord
+import itertools
+import json
 import math
-import random
+import os
 import re
+import time
 import typing
 import wavelink
-import aiosqlite
 
 from discord.ext import commands, menus
 from utilities.embeds import embed_error, set_style
+from utilities.cache import LRUCache, TTLCache
 from utilities.db import *
+from utilities.nodes import is_healthy, load_nodes, migrate_player, node_penalty, rebalance, select_node
+from utilities.queue import TrackQueue
+from utilities.sharding import handles_guild
 
 # URL matching REGEX...
 URL_REG = re.compile(r'https?://(?:www\.)?.+')
@@ -26,14 +33,26 @@ class IncorrectChannelError(commands.CommandError):
     pass
 
 class Track(wavelink.Track):
-    '''Wavelink Track object with a requester attribute.'''
+    '''Wavelink Track object with a requester attribute.
+    resolved is the time.monotonic() at which Lavalink returned the track, cached results keeping the time of the original
+    lookup. It is None for tracks rebuilt from the database (favourites and restored sessions), whose age is unknown:
+    those are never resolved again, so queueing them costs no Lavalink calls.'''
 
-    __slots__ = ('requester', )
+    __slots__ = ('requester', 'resolved')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args)
 
         self.requester = kwargs.get('requester')
+        self.resolved = kwargs.get('resolved', time.monotonic())
+
+def track_row(track: typing.Optional[wavelink.Track]) -> tuple:
+    '''Returns the encoded track, its info as JSON and the ID of its requester, as stored in the database.'''
+
+    if track is None:
+        return (None, None, None)
+    requester = getattr(track, 'requester', None)
+    return (track.id, json.dumps(track.info), requester.id if requester else None)
 
 class Player(wavelink.Player):
     '''Custom wavelink Player class.'''
@@ -45,11 +64,40 @@ class Player(wavelink.Player):
         if self.context:
             self.dj: discord.Member = self.context.author
 
-        self.queue = asyncio.Queue()
+        self.queue = TrackQueue()
         self.controller = None
+        self.eq = None
+
+        # Version of the queue when the last snapshot was saved.
+        self.snapshot_version = None
+
+        # Controller updates requested within CONTROLLER_UPDATE_INTERVAL seconds of the last one are coalesced into a single update.
+        self.controller_interval = float(os.getenv('CONTROLLER_UPDATE_INTERVAL', 2))
+        self.controller_task = None
+        self.controller_pending = False
+        self.controller_updated = 0
+        self.controller_embed = None
+
+        # The next track of the queue is resolved again while the current one plays if it is older than TRACK_MAX_AGE seconds.
+        self.track_max_age = int(os.getenv('TRACK_MAX_AGE', 3600))
+        self.prefetch_task = None
+        # time.monotonic() at which the last track ended with more tracks queued, to measure the gap until the next one starts.
+        self.track_ended = None
+
+        # Members other than bots in the voice channel of the player, kept up to date by MusicCog.on_voice_state_update.
+        self.listeners = set()
+
+        # IDs of the latest messages of the context channel, fed by MusicCog.on_message instead of reading the channel history.
+        self.recent_messages = collections.deque(maxlen=25)
+
+        # A player which has not played anything for PLAYER_IDLE_TIMEOUT seconds is torn down.
+        # idle_since and alone_since are kept by MusicCog.reap_players.
+        self.idle_timeout = int(os.getenv('PLAYER_IDLE_TIMEOUT', 300))
+        self.idle_since = None
+        self.alone_since = None
+        self.closed = False
 
         self.waiting = False
-        self.updating = False
 
         self.pause_votes = set()
         self.resume_votes = set()
@@ -57,6 +105,15 @@ class Player(wavelink.Player):
         self.shuffle_votes = set()
         self.stop_votes = set()
 
+    async def connect(self, channel_id: int, *args, **kwargs) -> None:
+        await super().connect(channel_id, *args, **kwargs)
+        self.reset_listeners(self.bot.get_channel(int(channel_id)))
+
+    def reset_listeners(self, channel: typing.Optional[discord.VoiceChannel]) -> None:
+        '''Counts the listeners of a voice channel from scratch, used when the player joins or is moved to it.'''
+
+        self.listeners = {member for member in channel.members if not member.bot} if channel else set()
+
     async def do_next(self) -> None:
         if self.is_playing or self.waiting:
             return
@@ -70,10 +127,10 @@ class Player(wavelink.Player):
 
         try:
             self.waiting = True
-            with async_timeout.timeout(300):
+            with async_timeout.timeout(self.idle_timeout):
                 track = await self.queue.get()
         except asyncio.TimeoutError:
-            # No music has been played for 5 minutes, cleanup and disconnect...
+            # No music has been played for a while, cleanup and disconnect...
             return await self.teardown()
 
         await self.play(track)
@@ -83,33 +140,62 @@ class Player(wavelink.Player):
         await self.invoke_controller()
 
     async def invoke_controller(self) -> None:
-        '''Method which updates or sends a new player controller.'''
+        '''Method which schedules an update of the players controller.'''
 
-        if self.updating:
-            return
+        self.controller_pending = True
+        if self.controller_task is None or self.controller_task.done():
+            self.controller_task = self.bot.loop.create_task(self.run_controller_updates())
+
+    async def run_controller_updates(self) -> None:
+        '''Applies the requested controller updates, waiting controller_interval seconds between two of them.'''
 
-        self.updating = True
+        while self.controller_pending:
+            delay = self.controller_updated + self.controller_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self.controller_pending = False
+            try:
+                await self.update_controller()
+            except discord.HTTPException:
+                pass
+            self.controller_updated = time.monotonic()
+
+    async def update_controller(self) -> None:
+        '''Method which updates or sends a new player controller.'''
+
+        embed = self.build_embed()
 
         if not self.controller:
-            self.controller = InteractiveController(embed=self.build_embed(), player=self)
-            await self.controller.start(self.context)
+            await self.send_controller(embed)
 
-        elif not await self.is_position_fresh():
+        elif not self.is_position_fresh():
             try:
                 await self.controller.message.delete()
             except discord.HTTPException:
                 pass
 
             self.controller.stop()
+            await self.send_controller(embed)
 
-            self.controller = InteractiveController(embed=self.build_embed(), player=self)
-            await self.controller.start(self.context)
-
-        else:
-            embed = self.build_embed()
+        elif embed and embed.to_dict() != self.controller_embed:
             await self.controller.message.edit(content=None, embed=embed)
+            self.controller_embed = embed.to_dict()
+
+    async def send_controller(self, embed: discord.Embed) -> None:
+        '''Sends a new player controller.'''
 
-        self.updating = False
+        self.controller = InteractiveController(embed=embed, player=self)
+        self.controller_embed = embed.to_dict() if embed else None
+        await self.controller.start(self.context)
+        if self.controller.message:
+            self.track_message(self.controller.message.id)
+
+    def track_message(self, message_id: int) -> None:
+        '''Records a new message of the context channel.'''
+
+        if message_id not in self.recent_messages:
+            self.recent_messages.append(message_id)
 
     def build_embed(self) -> typing.Optional[discord.Embed]:
         '''Method which builds our players controller embed.'''
@@ -119,7 +205,7 @@ class Player(wavelink.Player):
             return
 
         channel = self.bot.get_channel(int(self.channel_id))
-        qsize = self.queue.qsize()
+        qsize = len(self.queue)
 
         embed = discord.Embed(title=f'Music Controller | {channel.name}', colour=discord.Colour.purple())
         embed.description = f'Now Playing:\n**`{track.title}`**\n\n'
@@ -135,32 +221,98 @@ class Player(wavelink.Player):
 
         return embed
 
-    async def is_position_fresh(self) -> bool:
-        '''Method which checks whether the player controller should be remade or updated.'''
+    def is_position_fresh(self) -> bool:
+        '''Method which checks whether the player controller should be remade or updated.
+        It is fresh while it is one of the last 5 messages of the channel.'''
 
-        try:
-            async for message in self.context.channel.history(limit=5):
-                if message.id == self.controller.message.id:
-                    return True
-        except (discord.HTTPException, AttributeError):
+        message = getattr(self.controller, 'message', None)
+        if message is None:
             return False
 
-        return False
+        return message.id in itertools.islice(reversed(self.recent_messages), 5)
+
+    def prefetch(self) -> None:
+        '''Starts preparing the next track of the queue in the background.'''
+
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+        self.prefetch_task = self.bot.loop.create_task(self.prefetch_next())
+
+    async def prefetch_next(self) -> None:
+        '''Resolves the next track of the queue again if it has expired, so it can start as soon as the current one ends.
+        The track is asked to Lavalink directly, since the caches could hold the same expired data.
+        The fresh track replaces the queued one unless the queue changed in the meantime.'''
+
+        if not self.queue:
+            return
 
-    async def teardown(self):
-        '''Clear internal states, remove player controller and disconnect.'''
+        track = self.queue[0]
+        resolved = getattr(track, 'resolved', None)
+        if resolved is None or not track.uri or time.monotonic() - resolved < self.track_max_age:
+            return
 
         try:
-            await self.controller.message.delete()
-        except discord.HTTPException:
-            pass
+            tracks = await self.bot.wavelink.get_tracks(track.uri)
+        except Exception:
+            return
+        if not tracks:
+            return
+
+        fresh = tracks.tracks[0] if isinstance(tracks, wavelink.TrackPlaylist) else tracks[0]
+        fresh = Track(fresh.id, fresh.info)
+        if hasattr(self.bot, 'resolved_tracks'):
+            self.bot.resolved_tracks.put(track.uri, fresh)
+        if self.queue and self.queue[0] is track:
+            self.queue[0] = Track(fresh.id, fresh.info, requester=track.requester, resolved=fresh.resolved)
+
+    def snapshot(self) -> tuple:
+        '''Returns the state of the player as a music_sessions row.'''
+
+        track = self.current
+        return (self.guild_id, int(self.channel_id), self.context.channel.id, self.context.message.id, self.dj.id,
+                self.volume, int(self.is_paused), int(self.position), *track_row(track))
+
+    def snapshot_queue(self) -> list:
+        '''Returns the queued tracks as music_queue rows.'''
+
+        return [track_row(track) for track in self.queue]
+
+    async def teardown(self) -> bool:
+        '''Clear internal states, remove player controller and disconnect.
+        Returns whether the player was torn down: calling it again does nothing, unless the previous call failed.'''
 
-        self.controller.stop()
+        if self.closed:
+            return False
+        self.closed = True
 
         try:
-            await self.destroy()
-        except KeyError:
-            pass
+            if self.controller_task is not None:
+                self.controller_task.cancel()
+            if self.prefetch_task is not None:
+                self.prefetch_task.cancel()
+
+            if self.controller:
+                try:
+                    await self.controller.message.delete()
+                except (discord.HTTPException, AttributeError):
+                    pass
+
+                self.controller.stop()
+
+            try:
+                await self.destroy()
+            except KeyError:
+                pass
+        except Exception:
+            self.closed = False
+            raise
+
+        # Removed once the player is gone. A session left behind by a failure here is pruned by the next snapshot.
+        try:
+            await remove_music_session(self.guild_id)
+        except Exception as e:
+            self.bot.log.error(f'Could not remove the music session of guild {self.guild_id}: {e}')
+        return True
 
 
 class InteractiveController(menus.Menu):
@@ -190,7 +342,7 @@ class InteractiveController(menus.Menu):
             return False
         if payload.message_id != self.message.id:
             return False
-        if payload.member not in self.bot.get_channel(int(self.player.channel_id)).members:
+        if payload.member not in self.player.listeners:
             return False
 
         return payload.emoji in self.buttons
@@ -312,8 +464,10 @@ class PaginatorSource(menus.ListPageSource):
         super().__init__(entries, per_page=per_page)
 
     async def format_page(self, menu: menus.Menu, page):
+        # Entries are numbered across pages, as the commands acting on them take their absolute position.
+        start = menu.current_page * self.per_page
         embed = discord.Embed(title='Coming Up...', colour=discord.Colour.purple())
-        embed.description = '\n'.join(f'`{index}. {title}`' for index, title in enumerate(page, 1))
+        embed.description = '\n'.join(f'`{index}. {title}`' for index, title in enumerate(page, start + 1))
 
         return embed
 
@@ -322,6 +476,33 @@ class PaginatorSource(menus.ListPageSource):
         return True
 
 
+class QueueSource(menus.PageSource):
+    '''Player queue paginator class. Only the tracks of the page being shown are read from the queue.'''
+
+    def __init__(self, queue: TrackQueue, *, per_page=8):
+        self.queue = queue
+        self.per_page = per_page
+
+    def is_paginating(self):
+        # We always want to embed even on 1 page of results...
+        return True
+
+    def get_max_pages(self):
+        # The queue can change while the menu is open, so the number of pages is worked out every time.
+        return max(1, math.ceil(len(self.queue) / self.per_page))
+
+    async def get_page(self, page_number):
+        start = page_number * self.per_page
+        return start, self.queue.page(start, start + self.per_page)
+
+    async def format_page(self, menu: menus.Menu, page):
+        start, tracks = page
+        embed = discord.Embed(title='Coming Up...', colour=discord.Colour.purple())
+        embed.description = '\n'.join(f'`{index}. {track.title}`' for index, track in enumerate(tracks, start + 1))
+
+        return embed
+
+
 class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     '''Music Cog.'''
 
@@ -331,7 +512,53 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
         if not hasattr(bot, 'wavelink'):
             bot.wavelink = wavelink.Client(bot=bot)
 
+        # Recently resolved tracks by URL, kept on the bot so reloading the cog does not empty it.
+        if not hasattr(bot, 'resolved_tracks'):
+            bot.resolved_tracks = LRUCache(maxsize=int(os.getenv('RESOLVED_TRACKS_CACHE_SIZE', 512)))
+
+        # Search results shared by every guild, keyed by the normalised query.
+        if not hasattr(bot, 'search_cache'):
+            bot.search_cache = TTLCache(maxsize=int(os.getenv('SEARCH_CACHE_SIZE', 1024)), ttl=int(os.getenv('SEARCH_CACHE_TTL', 3600)))
+        self.negative_ttl = int(os.getenv('SEARCH_CACHE_NEGATIVE_TTL', 300))
+
+        # Commands which do not need a player, so cog_before_invoke does not create one for them.
+        self.no_player_commands = {'searchcache', 'nodes', 'musicstats'}
+
+        # Seconds between the end of a track and the start of the next queued one, for the latest track changes.
+        self.track_gaps = collections.deque(maxlen=100)
+
+        # Identifier -> weight of the Lavalink nodes, read from config/nodes.json.
+        self.node_weights = {}
+
+        # Maximum number of Lavalink searches running at the same time for a single command.
+        self.resolve_concurrency = int(os.getenv('RESOLVE_CONCURRENCY', 4))
+
+        # Players are moved away from nodes which disconnect or have a penalty over NODE_MAX_PENALTY.
+        self.node_check_interval = int(os.getenv('NODE_CHECK_INTERVAL', 10))
+        self.node_max_penalty = float(os.getenv('NODE_MAX_PENALTY', 500))
+
+        # The players are saved every MUSIC_SNAPSHOT_INTERVAL seconds and restored once the nodes are connected.
+        self.snapshot_interval = int(os.getenv('MUSIC_SNAPSHOT_INTERVAL', 15))
+
         bot.loop.create_task(self.start_nodes())
+        # Abandoned players are torn down: idle for PLAYER_IDLE_TIMEOUT seconds, alone in their voice channel for
+        # PLAYER_ALONE_TIMEOUT seconds or whose text channel was deleted. Checked every PLAYER_REAPER_INTERVAL seconds.
+        self.alone_timeout = int(os.getenv('PLAYER_ALONE_TIMEOUT', 120))
+        self.reaper_interval = int(os.getenv('PLAYER_REAPER_INTERVAL', 30))
+        self.reaped_players = 0
+
+        self.node_watcher = bot.loop.create_task(self.watch_nodes())
+        self.snapshotter = bot.loop.create_task(self.snapshot_loop())
+        self.reaper = bot.loop.create_task(self.reap_players())
+
+    def cog_unload(self):
+        '''Stops the background tasks of the cog and saves the players a last time, since reloading the cog restarts the nodes.'''
+
+        self.node_watcher.cancel()
+        self.snapshotter.cancel()
+        self.reaper.cancel()
+        # Kept on the bot so the next instance of the cog waits for it before restoring the players.
+        self.bot.music_snapshot = self.bot.loop.create_task(self.save_sessions(*self.collect_sessions(), prune=False))
 
     async def start_nodes(self) -> None:
         '''Connect and initiate nodes.'''
@@ -344,16 +571,325 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
             for node in previous.values():
                 await node.destroy()
 
-        nodes = {'MAIN': {'host': 'localhost',
-                          'port': 2333,
-                          'rest_uri': 'http://localhost:2333',
-                          'password': 'ShuwyBOT311',
-                          'identifier': 'MAIN',
-                          'region': 'europe'
-                          }}
+        # The nodes are listed in config/nodes.json, together with their region and weight.
+        for node, weight in load_nodes():
+            self.node_weights[node['identifier']] = weight
+            await self.bot.wavelink.initiate_node(**node)
+
+        await self.restore_sessions()
+
+    def players(self) -> typing.Iterator[Player]:
+        '''Iterates over the players of every node.'''
+
+        for node in self.bot.wavelink.nodes.values():
+            yield from node.players.values()
+
+    def find_player(self, guild_id: int) -> typing.Optional[Player]:
+        '''Returns the player of a guild, or None if it has none. Unlike wavelink.get_player, no player is created.'''
+
+        for node in self.bot.wavelink.nodes.values():
+            player = node.players.get(guild_id)
+            if player is not None:
+                return player
+        return None
+
+    async def snapshot_loop(self) -> None:
+        '''Background task which saves the state of the players every snapshot_interval seconds.'''
+
+        await self.bot.wait_until_ready()
+
+        while not self.bot.is_closed():
+            await asyncio.sleep(self.snapshot_interval)
+            await self.save_sessions(*self.collect_sessions())
+
+    def collect_sessions(self) -> tuple:
+        '''Returns the position, volume, DJ and current track of every connected player, and the queues which changed
+        since the last snapshot.'''
+
+        sessions, queues = [], {}
+        for player in list(self.players()):
+            if not player.is_connected or not player.context:
+                continue
+            sessions.append(player.snapshot())
+            if player.queue.version != player.snapshot_version:
+                queues[player.guild_id] = player.snapshot_queue()
+                player.snapshot_version = player.queue.version
+        return sessions, queues
+
+    async def save_sessions(self, sessions: list, queues: dict, prune: bool = True) -> None:
+        '''Writes the snapshot of the players. With prune, the sessions of players torn down in the meantime are removed.'''
+
+        if not sessions:
+            return
+
+        try:
+            await save_music_sessions(sessions, queues)
+        except Exception as e:
+            self.bot.log.error(f'Could not save the music sessions: {e}')
+            for guild_id in queues:
+                player = self.find_player(guild_id)
+                if player is not None:
+                    player.snapshot_version = None
+            return
+
+        if not prune:
+            return
+
+        # Players torn down while the snapshot was being written must not come back on the next start.
+        for row in sessions:
+            if self.find_player(row[0]) is None:
+                await remove_music_session(row[0])
+
+    async def restore_sessions(self) -> None:
+        '''Rebuilds the players saved before the bot restarted or the cog was reloaded.'''
+
+        pending = getattr(self.bot, 'music_snapshot', None)
+        if pending is not None:
+            await asyncio.wait([pending])
+
+        for row in await get_music_sessions():
+            guild_id = row[0]
+            # The database is shared by every cluster, the sessions of the guilds of other shards are left alone.
+            if not handles_guild(self.bot, guild_id) or self.find_player(guild_id) is not None:
+                continue
+
+            try:
+                restored = await self.restore_session(*row)
+            except Exception as e:
+                self.bot.log.warning(f'Could not restore the music session of guild {guild_id}: {e}')
+                restored = False
+
+            if not restored:
+                await remove_music_session(guild_id)
+
+    async def restore_session(self, guild_id, voice_channel_id, text_channel_id, message_id, dj_id, volume, paused, position,
+                              encoded, info, requester_id) -> bool:
+        '''Rebuilds a saved player and resumes its playback where it was. The context of the player is rebuilt from the
+        message which started it or, when it was deleted, from a notice sent to the same channel on behalf of the DJ.
+        Sessions whose channels or listeners are gone are not restored.'''
+
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return False
+
+        voice = guild.get_channel(voice_channel_id)
+        channel = guild.get_channel(text_channel_id)
+        if voice is None or channel is None or all(member.bot for member in voice.members):
+            return False
+
+        queue = await get_music_queue(guild_id)
+        if encoded is None and not queue:
+            return False
+
+        dj = guild.get_member(dj_id) or next(member for member in voice.members if not member.bot)
+        try:
+            message = await channel.fetch_message(message_id)
+        except discord.NotFound:
+            # Commands are often cleaned up, the session does not depend on its first message still being there.
+            embed = discord.Embed(description=f'Resuming the music session of {dj.mention}.', color=discord.Colour.purple())
+            message = await channel.send(embed=set_style(embed))
+        ctx = await self.bot.get_context(message)
+        if message.author == guild.me:
+            ctx.author = dj
+        player: Player = self.get_player(ctx)
+        player.dj = dj
+
+        def build_track(encoded, info, requester_id):
+            return Track(encoded, json.loads(info), requester=guild.get_member(requester_id) or player.dj, resolved=None)
+
+        player.queue.extend(build_track(*row) for row in queue)
+
+        await player.connect(voice.id)
+        await player.set_volume(volume)
+
+        if encoded is None:
+            await player.do_next()
+        else:
+            await player.play(build_track(encoded, info, requester_id), start=position)
+            if paused:
+                await player.set_pause(True)
+            await player.invoke_controller()
+
+        self.bot.log.info(f'Restored the music session of guild {guild_id} with {len(queue)} queued songs.')
+        return True
+
+    def is_healthy(self, node: wavelink.Node, moved: dict = None) -> bool:
+        '''Whether a node is connected and not overloaded, its penalty being divided by its weight.'''
+
+        return is_healthy(node, self.node_max_penalty, self.node_weights, moved)
+
+    async def watch_nodes(self) -> None:
+        '''Background task which moves the players of disconnected or overloaded nodes to healthy ones, see utilities.nodes.rebalance.'''
+
+        await self.bot.wait_until_ready()
+
+        while not self.bot.is_closed():
+            await asyncio.sleep(self.node_check_interval)
+            await rebalance(self.bot.wavelink.nodes.values(), self.migrate_player, self.node_max_penalty, self.node_weights)
+
+    async def migrate_player(self, player: Player, moved: dict = None) -> bool:
+        '''Moves a player to the least loaded healthy node, see utilities.nodes.migrate_player.
+        The queue stays as it is since it belongs to the Player object.'''
+
+        old = player.node
+        guild = self.bot.get_guild(player.guild_id)
+        region = str(guild.region) if guild else None
+        try:
+            node = await migrate_player(player, self.bot.wavelink.nodes.values(), self.node_max_penalty, self.node_weights,
+                                        region=region, moved=moved)
+        except Exception as e:
+            self.bot.log.error(f'Could not move the player of guild {player.guild_id} from {old.identifier}: {e}')
+            return False
+
+        if node is None:
+            self.bot.log.warning(f'No healthy Lavalink node to move the player of guild {player.guild_id} from {old.identifier}.')
+            return False
+
+        self.bot.log.info(f'Moved the player of guild {player.guild_id} from {old.identifier} to {node.identifier}.')
+        return True
+
+    async def reap_players(self) -> None:
+        '''Background task which tears down the abandoned players.'''
+
+        await self.bot.wait_until_ready()
+
+        while not self.bot.is_closed():
+            await asyncio.sleep(self.reaper_interval)
+
+            now = time.monotonic()
+            for player in list(self.players()):
+                reason = self.reap_reason(player, now)
+                if reason is None:
+                    continue
+
+                try:
+                    if not await self.reap(player):
+                        continue
+                except Exception as e:
+                    self.bot.log.error(f'Could not tear down the player of guild {player.guild_id}: {e}')
+                    continue
+                self.bot.log.info(f'Tore down the player of guild {player.guild_id}: {reason}.')
+
+    def reap_reason(self, player: Player, now: float) -> typing.Optional[str]:
+        '''Updates the idle and alone times of a player and returns why it should be torn down, or None.'''
+
+        if player.is_playing and not player.is_paused:
+            player.idle_since = None
+        elif player.idle_since is None:
+            player.idle_since = now
+
+        if player.listeners or not player.is_connected:
+            player.alone_since = None
+        elif player.alone_since is None:
+            player.alone_since = now
+
+        if player.context and self.bot.get_channel(player.context.channel.id) is None:
+            return 'its text channel was deleted'
+        if player.idle_since is not None and now - player.idle_since >= player.idle_timeout:
+            return 'idle'
+        if player.alone_since is not None and now - player.alone_since >= self.alone_timeout:
+            return 'alone in its voice channel'
+        return None
+
+    async def reap(self, player: Player) -> bool:
+        '''Tears down a player and returns whether it did. Players which never connected are only forgotten.'''
+
+        if player.is_connected and player.context:
+            if not await player.teardown():
+                return False
+        else:
+            player.node.players.pop(player.guild_id, None)
+        self.reaped_players += 1
+        return True
+
+    def get_player(self, ctx: commands.Context) -> Player:
+        '''Returns the player of the guild. New players are placed on the least loaded node, preferring the guild's region.'''
 
-        for n in nodes.values():
-            await self.bot.wavelink.initiate_node(**n)
+        player = self.find_player(ctx.guild.id)
+        if player is not None:
+            return player
+
+        node = select_node(self.bot.wavelink.nodes.values(), self.node_weights, region=str(ctx.guild.region))
+        node_id = node.identifier if node else None
+        return self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx, node_id=node_id)
+
+    def search_key(self, query: str) -> str:
+        '''Normalises a query for the search cache. URLs are kept as they are, since their IDs are case sensitive.'''
+
+        if URL_REG.match(query):
+            return query
+        return ' '.join(query.lower().split())
+
+    async def search(self, query: str) -> tuple:
+        '''Sends a query to Lavalink, reusing the results of the same query in the last SEARCH_CACHE_TTL seconds.
+        Queries without results are cached as well, for SEARCH_CACHE_NEGATIVE_TTL seconds.
+        Returns the tracks and the time.monotonic() at which Lavalink returned them, which is older for cached results.'''
+
+        key = self.search_key(query)
+        entry = self.bot.search_cache.get(key)
+        if entry is not None:
+            tracks, resolved = entry
+            return tracks or None, resolved
+
+        tracks = await self.bot.wavelink.get_tracks(query)
+        resolved = time.monotonic()
+        if tracks:
+            self.bot.search_cache.put(key, (tracks, resolved))
+        else:
+            self.bot.search_cache.put(key, ((), resolved), ttl=self.negative_ttl)
+        return tracks, resolved
+
+    async def resolve_track(self, url: str) -> typing.Optional[Track]:
+        '''Resolves a URL into a track, reusing the recently resolved ones. The track keeps the time it was resolved at.'''
+
+        track = self.bot.resolved_tracks.get(url)
+        if track is None:
+            tracks, resolved = await self.search(url)
+            if not tracks:
+                return None
+            track = tracks.tracks[0] if isinstance(tracks, wavelink.TrackPlaylist) else tracks[0]
+            track = Track(track.id, track.info, resolved=resolved)
+            self.bot.resolved_tracks.put(url, track)
+        return track
+
+    async def resolve_tracks(self, identifiers: typing.List[str]) -> typing.List[typing.Optional[wavelink.Track]]:
+        '''Resolves many URLs or searches concurrently, keeping their order. Identifiers that fail resolve to None.'''
+
+        semaphore = asyncio.Semaphore(self.resolve_concurrency)
+
+        async def resolve(identifier):
+            async with semaphore:
+                try:
+                    return await self.resolve_track(identifier)
+                except Exception as e:
+                    self.bot.log.warning(f'Could not resolve {identifier}: {e}')
+                    return None
+
+        return await asyncio.gather(*(resolve(identifier) for identifier in identifiers))
+
+    async def enqueue_tracks(self, ctx: commands.Context, player: Player, tracks: typing.List[Track], failed: typing.List[str] = ()) -> None:
+        '''Queues many tracks at once and reports them with a single summary message.'''
+
+        player.queue.extend(tracks)
+
+        description = f'Added {len(tracks)} songs to the queue.'
+        if failed:
+            description += '\n\nCould not load:\n' + '\n'.join(f'`{name}`' for name in failed)
+        embed = discord.Embed(description=description, color=discord.Colour.purple())  
+        await ctx.send(embed=set_style(embed), delete_after=8)
+
+        if tracks and not player.is_playing:
+            await player.do_next()
+
+    def favourite_track(self, member: discord.Member, row) -> typing.Optional[Track]:
+        '''Builds the track of a favourite from its stored data, or returns None if it was never resolved.'''
+
+        position, url, title, length, encoded, identifier = row
+        if encoded is None:
+            return None
+
+        info = {'title': title, 'uri': url, 'length': length, 'identifier': identifier or ''}
+        return Track(encoded, info, requester=member, resolved=None)
 
     @wavelink.WavelinkMixin.listener()
     async def on_node_ready(self, node: wavelink.Node):
@@ -363,31 +899,70 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     @wavelink.WavelinkMixin.listener('on_track_end')
     @wavelink.WavelinkMixin.listener('on_track_exception')
     async def on_player_stop(self, node: wavelink.Node, payload):
-        await payload.player.do_next()
+        player = payload.player
+        if player.queue:
+            player.track_ended = time.monotonic()
+        await player.do_next()
+
+    @wavelink.WavelinkMixin.listener()
+    async def on_track_start(self, node: wavelink.Node, payload):
+        player = payload.player
+        if player.track_ended is not None:
+            self.track_gaps.append(time.monotonic() - player.track_ended)
+            player.track_ended = None
+        player.prefetch()
 
     @commands.Cog.listener()
-    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
-        if member.bot:
+    async def on_message(self, message: discord.Message):
+        if not message.guild:
+            return
+
+        player = self.find_player(message.guild.id)
+        if player is not None and player.context and player.context.channel.id == message.channel.id:
+            player.track_message(message.id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if not payload.guild_id:
             return
 
-        player: Player = self.bot.wavelink.get_player(member.guild.id, cls=Player)
+        player = self.find_player(payload.guild_id)
+        if player is not None and payload.message_id in player.recent_messages:
+            player.recent_messages.remove(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        # Guilds without a music session return here, no player is created for them.
+        player = self.find_player(member.guild.id)
+        if player is None:
+            return
 
         if not player.channel_id or not player.context:
-            player.node.players.pop(member.guild.id)
+            player.node.players.pop(member.guild.id, None)
             return
 
-        channel = self.bot.get_channel(int(player.channel_id))
+        if member == member.guild.me:
+            if before.channel != after.channel:
+                player.reset_listeners(after.channel)
+            return
 
-        if member == player.dj and after.channel is None:
-            for m in channel.members:
-                if m.bot:
-                    continue
-                else:
-                    player.dj = m
-                    return
+        if member.bot:
+            return
 
-        elif after.channel == channel and player.dj not in channel.members:
-            player.dj = member
+        channel_id = int(player.channel_id)
+        joined = after.channel is not None and after.channel.id == channel_id
+        left = before.channel is not None and before.channel.id == channel_id
+        if joined == left:
+            return
+
+        if joined:
+            player.listeners.add(member)
+            if player.dj not in player.listeners:
+                player.dj = member
+        else:
+            player.listeners.discard(member)
+            if member == player.dj and player.listeners:
+                player.dj = next(iter(player.listeners))
 
     async def cog_command_error(self, ctx: commands.Context, error: Exception):
         '''Cog wide error handler.'''
@@ -413,7 +988,10 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
         '''Coroutine called before command invocation.
         We mainly just want to check whether the user is in the players controller channel.'''
 
-        player: Player = self.bot.wavelink.get_player(ctx.guild.id, cls=Player, context=ctx)
+        if ctx.command.name in self.no_player_commands:
+            return
+
+        player: Player = self.get_player(ctx)
         if player.context:
             if player.context.channel != ctx.channel:
                 embed = discord.Embed(description=f'{ctx.author.mention}, you must be in {player.context.channel.mention} for this session.', color=discord.Colour.purple())  
@@ -433,7 +1011,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
             return
 
         if player.is_connected:
-            if ctx.author not in channel.members:
+            if ctx.author not in player.listeners:
                 embed = discord.Embed(description=f'{ctx.author.mention}, you must be in `{channel.name}` to use voice commands.', color=discord.Colour.purple())  
                 await ctx.send(embed=set_style(embed))
                 raise IncorrectChannelError
@@ -441,12 +1019,11 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     def required(self, ctx: commands.Context):
         '''Method which returns required votes based on amount of members in a channel.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
-        channel = self.bot.get_channel(int(player.channel_id))
-        required = math.ceil((len(channel.members) - 1) / 2.5)
+        player: Player = self.get_player(ctx)
+        required = math.ceil(len(player.listeners) / 2.5)
 
         if ctx.command.name == 'stop':
-            if len(channel.members) - 1 == 2:
+            if len(player.listeners) == 2:
                 required = 2
 
         return required
@@ -454,7 +1031,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     def is_privileged(self, ctx: commands.Context):
         '''Check whether the user is an Admin or DJ.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         return player.dj == ctx.author or ctx.author.guild_permissions.kick_members
 
@@ -463,7 +1040,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def connect(self, ctx: commands.Context, *, channel: discord.VoiceChannel = None):
         '''Connect to a voice channel.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if player.is_connected:
             return
@@ -479,7 +1056,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def play(self, ctx: commands.Context, *, query: str):
         '''Play or queue a song with the given query.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             await ctx.invoke(self.connect)
@@ -488,34 +1065,80 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
         if not URL_REG.match(query):
             query = f'ytsearch:{query}'
 
-        tracks = await self.bot.wavelink.get_tracks(query)
+        tracks, resolved = await self.search(query)
         if not tracks:
             embed = discord.Embed(description='No songs were found with that query. Please try again.', color=discord.Colour.purple())  
             return await ctx.send(embed=set_style(embed), delete_after=8)
 
         if isinstance(tracks, wavelink.TrackPlaylist):
-            for track in tracks.tracks:
-                track = Track(track.id, track.info, requester=ctx.author)
-                await player.queue.put(track)
+            # The whole playlist is added with a single extend instead of an awaited put per song. A Track is still built for
+            # every song, as many as before, since extend consumes the generator at once.
+            payload = tracks.data['tracks']
+            player.queue.extend(Track(track['track'], track['info'], requester=ctx.author, resolved=resolved) for track in payload)
 
             embed = discord.Embed(description=f'Added the playlist {tracks.data["playlistInfo"]["name"]}'
                                               f' with {len(tracks.tracks)} songs to the queue.', color=discord.Colour.purple())  
             await ctx.send(embed=set_style(embed), delete_after=8) 
         else:
-            track = Track(tracks[0].id, tracks[0].info, requester=ctx.author)
+            track = Track(tracks[0].id, tracks[0].info, requester=ctx.author, resolved=resolved)
             embed = discord.Embed(description=f'Added {track.title} to the Queue', color=discord.Colour.purple())  
             await ctx.send(embed=set_style(embed), delete_after=8)
-            await player.queue.put(track)
+            player.queue.put(track)
 
         if not player.is_playing:
             await player.do_next()
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def searchcache(self, ctx: commands.Context):
+        '''Shows the counters of the shared search cache.'''
+
+        cache = self.bot.search_cache
+        lookups = cache.hits + cache.misses
+        ratio = cache.hits / lookups * 100 if lookups else 0
+        embed = discord.Embed(title='Search Cache', color=discord.Colour.purple())
+        embed.add_field(name='Entries', value=f'{len(cache)} / {cache.maxsize}')
+        embed.add_field(name='Hits', value=str(cache.hits))
+        embed.add_field(name='Misses', value=str(cache.misses))
+        embed.add_field(name='Hit ratio', value=f'{ratio:.1f}%')
+        await ctx.send(embed=set_style(embed))
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def nodes(self, ctx: commands.Context):
+        '''Shows the load of every Lavalink node.'''
+
+        embed = discord.Embed(title='Lavalink Nodes', color=discord.Colour.purple())
+        for node in self.bot.wavelink.nodes.values():
+            status = 'available' if node.is_available else 'unavailable'
+            weight = self.node_weights.get(node.identifier, 1)
+            embed.add_field(name=f'{node.identifier} ({node.region})',
+                            value=f'{status}\n{len(node.players)} players\npenalty {node_penalty(node):.1f}, weight {weight}')
+        await ctx.send(embed=set_style(embed))
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def musicstats(self, ctx: commands.Context):
+        '''Shows the players and the gaps between tracks.'''
+
+        players = list(self.players())
+        idle = sum(1 for player in players if player.idle_since is not None or player.alone_since is not None)
+        embed = discord.Embed(title='Music Stats', color=discord.Colour.purple())
+        embed.add_field(name='Players', value=f'{len(players) - idle} live\n{idle} idle\n{self.reaped_players} reaped')
+        if self.track_gaps:
+            gaps = sorted(self.track_gaps)
+            embed.add_field(name='Track gaps', value=f'{len(gaps)} measured')
+            embed.add_field(name='Mean gap', value=f'{sum(gaps) / len(gaps) * 1000:.0f} ms')
+            embed.add_field(name='95th percentile', value=f'{gaps[min(len(gaps) - 1, int(len(gaps) * 0.95))] * 1000:.0f} ms')
+            embed.add_field(name='Max gap', value=f'{gaps[-1] * 1000:.0f} ms')
+        await ctx.send(embed=set_style(embed))
+
     @commands.command()
     @commands.guild_only()
     async def pause(self, ctx: commands.Context):
         '''Pause the currently playing song.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if player.is_paused or not player.is_connected:
             return
@@ -544,7 +1167,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def resume(self, ctx: commands.Context):
         '''Resume a currently paused player.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_paused or not player.is_connected:
             return
@@ -573,7 +1196,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def skip(self, ctx: commands.Context):
         '''Skip the currently playing song.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             return
@@ -609,7 +1232,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def stop(self, ctx: commands.Context):
         '''Stop the player and clear all internal states.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             return
@@ -635,7 +1258,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def favoure(self, ctx: commands.Context):
         '''Add the current song to your favourites'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             return
@@ -645,100 +1268,63 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
             return
 
         member = ctx.author
-        database = await db_connect()
-        cursor = await database.cursor()
-        await cursor.execute(f"SELECT EXISTS(SELECT 1 FROM music WHERE member_id = {member.id})")
-        if cursor.fetchone()[0] is 1:
-            # Check if the favourite list is full
-            await cursor.execute(f"SELECT favourite10 FROM music WHERE member_id = {member.id}")
-            if await cursor.fetchone()[0] is not None:
-                embed = discord.Embed(description='You have already reached the maximum number of favourites, please delete some before adding more.', color=discord.Colour.purple()) 
-                return await ctx.send(embed=set_style(embed))
-            found = False
-            favourite = "favourite"
-            number = 1
-            while (found == False and number <= 10 ):
-                string = favourite + str(number)
-                await cursor.execute(f"SELECT {string} FROM music WHERE member_id = {member.id}")
-                result = cursor.fetchone()[0]
-                if result is None:
-                    sql = (f"UPDATE music SET {string} = ? WHERE member_id = ?")
-                    val = (track.uri, member.id)
-                    await cursor.execute(sql, val)
-                    await database.commit()
-                    await cursor.close()
-                    await database.close()
-                    found = True
-                    embed = discord.Embed(description=f"The song {track.title} has been added to your favourites.", color=discord.Colour.purple()) 
-                    return await ctx.send(embed=set_style(embed))
-                else:
-                    if result == track.uri:
-                        embed = discord.Embed(description='This song is already in your favourite list!', color=discord.Colour.purple()) 
-                        return await ctx.send(embed=set_style(embed))
-                    number += 1
-        else:
-            sql = ('INSERT INTO music(member_id, favourite1) VALUES(?, ?)')
-            val = (member.id, track.uri)
-            await cursor.execute(sql, val)
-            await database.commit()
-            await cursor.close()
-            await database.close()
-            embed = discord.Embed(description=f"The song {track.title} has been added to your favourites.", color=discord.Colour.purple())  
+        favourites = await get_favourites(member.id)
+        if any(row[1] == track.uri for row in favourites):
+            embed = discord.Embed(description='This song is already in your favourite list!', color=discord.Colour.purple()) 
             return await ctx.send(embed=set_style(embed))
+
+        self.bot.resolved_tracks.put(track.uri, track)
+        if not await add_favourite(member.id, track.uri, track.title, track.length, track.id, track.identifier):
+            embed = discord.Embed(description='You have already reached the maximum number of favourites, please delete some before adding more.', color=discord.Colour.purple()) 
+            return await ctx.send(embed=set_style(embed))
+
+        embed = discord.Embed(description=f"The song {track.title} has been added to your favourites.", color=discord.Colour.purple())  
+        return await ctx.send(embed=set_style(embed))
         
     @commands.command(aliases=['pfav', 'playfav'])
     @commands.guild_only()
     async def play_favourites(self, ctx: commands.Context):
         '''Queues your list of favourite songs'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             await ctx.invoke(self.connect)
 
         member = ctx.author
-        database = await db_connect()
-        cursor = await database.cursor()
-        last = False
-        number = 1
-        while (last == False and number <= 10):
-            string = "favourite" + str(number)
-            await cursor.execute(f"SELECT {string} FROM music WHERE member_id = {member.id}")
-            url = await cursor.fetchone()[0]
-            if url is None:
-                last = True
-            else:
-                trackObj = await self.bot.wavelink.get_tracks(url)
-                track = Track(trackObj[0].id, trackObj[0].info, requester=ctx.author)
-                embed = discord.Embed(description=f'Added {track.title} to the Queue', color=discord.Colour.purple())  
-                await ctx.send(embed=set_style(embed), delete_after=8)
-                await player.queue.put(track)
+        rows = await get_favourites(member.id)
+        if not rows:
+            embed = discord.Embed(description='Your favourite list is empty.', color=discord.Colour.purple())  
+            return await ctx.send(embed=set_style(embed), delete_after=8)
+
+        # Favourites saved with their track are queued as they are, the rest are resolved together and stored.
+        tracks = [self.favourite_track(member, row) for row in rows]
+        missing = [index for index, track in enumerate(tracks) if track is None]
+        resolved = await self.resolve_tracks([rows[index][1] for index in missing])
+
+        failed = []
+        for index, track in zip(missing, resolved):
+            url = rows[index][1]
+            if track is None:
+                failed.append(rows[index][2] or url)
+                continue
+            await set_favourite_track(member.id, url, track.title, track.length, track.id, track.identifier)
+            tracks[index] = Track(track.id, track.info, requester=member, resolved=track.resolved)
 
-                if not player.is_playing:
-                    await player.do_next()
-            number += 1
+        await self.enqueue_tracks(ctx, player, [track for track in tracks if track is not None], failed)
 
     @commands.command(aliases=['favs', 'showfav'])
     @commands.guild_only()
     async def favourites(self, ctx: commands.Context):
-        member = ctx.author
-        database = await db_connect()
-        cursor = await database.cursor()
-        last = False
-        number = 1
-        entries = []
-        while (last == False and number <= 10):
-            string = "favourite" + str(number)
-            await cursor.execute(f"SELECT {string} FROM music WHERE member_id = {member.id}")
-            url = cursor.fetchone()[0]
-            if url is None:
-                last = True
-            else:
-                trackObj = await self.bot.wavelink.get_tracks(url)
-                track = Track(trackObj[0].id, trackObj[0].info, requester=ctx.author)
-                entries.append(track)
-            number += 1
-        titles = [track.title for track in entries]
+        '''Displays your list of favourite songs.'''
+
+        favourites = await get_favourites(ctx.author.id)
+        if not favourites:
+            embed = discord.Embed(description='Your favourite list is empty.', color=discord.Colour.purple())  
+            return await ctx.send(embed=set_style(embed), delete_after=8)
+
+        # Favourites migrated from the old layout only have their URL.
+        entries = [row[2] or row[1] for row in favourites]
         pages = PaginatorSource(entries=entries)
         paginator = menus.MenuPages(source=pages, timeout=None, delete_message_after=True)
         await paginator.start(ctx)
@@ -746,28 +1332,33 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     @commands.command(aliases=['dfav', 'delfav'])
     @commands.guild_only()
     async def delete_fav(self, ctx: commands.Context, *, index: int):
-        member = ctx.author
-        database = await db_connect()
-        cursor = await database.cursor()
-        while (index < 10):
-            string = "favourite" + str(index)
-            stringNext = "favourite" + str(index + 1)
-            await cursor.execute(f"UPDATE music SET {string} = {stringNext} WHERE member_id = {member.id}")
-            index += 1
-        await cursor.execute(f"UPDATE music SET {string} = null WHERE  member_id = {member.id}")
-        await database.commit()
-        await cursor.close()
-        await database.close()
+        '''Removes the song at the given position from your favourites.'''
+
+        if not await remove_favourite(ctx.author.id, index):
+            embed = discord.Embed(description=f'There is no song at position {index} of your favourite list.', color=discord.Colour.purple())  
+            return await ctx.send(embed=set_style(embed), delete_after=8)
+
         embed = discord.Embed(description='Removed a track from your favourite list.', color=discord.Colour.purple())  
         return await ctx.send(embed=set_style(embed), delete_after=8)
 
+    @commands.command(aliases=['mfav', 'movefav'])
+    @commands.guild_only()
+    async def move_fav(self, ctx: commands.Context, source: int, target: int):
+        '''Moves a song of your favourites from one position to another.'''
+
+        if source < 1 or target < 1 or not await move_favourite(ctx.author.id, source, target):
+            embed = discord.Embed(description='Please enter two positions of your favourite list.', color=discord.Colour.purple())  
+            return await ctx.send(embed=set_style(embed), delete_after=8)
+
+        embed = discord.Embed(description=f'Moved the song at position {source} of your favourite list to position {target}.', color=discord.Colour.purple())  
+        return await ctx.send(embed=set_style(embed), delete_after=8)
 
     @commands.command(aliases=['v', 'vol'])
     @commands.guild_only()
     async def volume(self, ctx: commands.Context, *, vol: int):
         '''Change the players volume, between 1 and 100.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             return
@@ -789,12 +1380,12 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def shuffle(self, ctx: commands.Context):
         '''Shuffle the players queue.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             return
 
-        if player.queue.qsize() < 3:
+        if len(player.queue) < 3:
             embed = discord.Embed(description='Add more songs to the queue before shuffling.', color=discord.Colour.purple())  
             return await ctx.send(embed=set_style(embed), delete_after=8)
 
@@ -802,7 +1393,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
             embed = discord.Embed(description='An admin or DJ has shuffled the playlist.', color=discord.Colour.purple())  
             await ctx.send(embed=set_style(embed), delete_after=8)
             player.shuffle_votes.clear()
-            return random.shuffle(player.queue._queue)
+            return player.queue.shuffle()
 
         required = self.required(ctx)
         player.shuffle_votes.add(ctx.author)
@@ -811,7 +1402,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
             embed = discord.Embed(description='Vote to shuffle passed. Shuffling the playlist.', color=discord.Colour.purple())  
             await ctx.send(embed=set_style(embed), delete_after=8)
             player.shuffle_votes.clear()
-            random.shuffle(player.queue._queue)
+            player.queue.shuffle()
         else:
             embed = discord.Embed(description=f'{ctx.author.mention} has voted to shuffle the playlist.', color=discord.Colour.purple())  
             await ctx.send(embed=set_style(embed), delete_after=8)
@@ -821,7 +1412,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def vol_up(self, ctx: commands.Context):
         '''Command used for volume up button.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected or not self.is_privileged(ctx):
             return
@@ -840,7 +1431,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def vol_down(self, ctx: commands.Context):
         '''Command used for volume down button.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected or not self.is_privileged(ctx):
             return
@@ -859,7 +1450,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def equalizer(self, ctx: commands.Context, *, equalizer: str):
         '''Change the players equalizer.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             return
@@ -883,33 +1474,100 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
         embed = discord.Embed(description=f'Successfully changed equalizer to {equalizer}', color=discord.Colour.purple())  
         await ctx.send(embed=set_style(embed), delete_after=8)
         await player.set_eq(eq)
+        player.eq = eq
 
     @commands.command(aliases=['q', 'que'])
     @commands.guild_only()
     async def queue(self, ctx: commands.Context):
         '''Display the players queued songs.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             return
 
-        if player.queue.qsize() == 0:
+        if not player.queue:
             embed = discord.Embed(description='There are no more songs in the queue.', color=discord.Colour.purple())  
             return await ctx.send(embed=set_style(embed), delete_after=8)
 
-        entries = [track.title for track in player.queue._queue]
-        pages = PaginatorSource(entries=entries)
+        pages = QueueSource(player.queue)
         paginator = menus.MenuPages(source=pages, timeout=None, delete_message_after=True)
 
         await paginator.start(ctx)
 
+    @commands.command(aliases=['rm'])
+    @commands.guild_only()
+    async def remove(self, ctx: commands.Context, *, index: int):
+        '''Removes the song at the given position from the queue.'''
+
+        player: Player = self.get_player(ctx)
+
+        if not player.is_connected:
+            return
+
+        if not self.is_privileged(ctx):
+            embed = discord.Embed(description='Only the DJ or admins may remove songs from the queue.', color=discord.Colour.purple())  
+            return await ctx.send(embed=set_style(embed), delete_after=8)
+
+        if not 0 < index <= len(player.queue):
+            embed = discord.Embed(description=f'There is no song at position {index} of the queue.', color=discord.Colour.purple())  
+            return await ctx.send(embed=set_style(embed), delete_after=8)
+
+        track = player.queue.remove(index - 1)
+        embed = discord.Embed(description=f'Removed {track.title} from the queue.', color=discord.Colour.purple())  
+        await ctx.send(embed=set_style(embed), delete_after=8)
+
+    @commands.command(aliases=['mv'])
+    @commands.guild_only()
+    async def move(self, ctx: commands.Context, source: int, target: int):
+        '''Moves a song of the queue from one position to another.'''
+
+        player: Player = self.get_player(ctx)
+
+        if not player.is_connected:
+            return
+
+        if not self.is_privileged(ctx):
+            embed = discord.Embed(description='Only the DJ or admins may move songs in the queue.', color=discord.Colour.purple())  
+            return await ctx.send(embed=set_style(embed), delete_after=8)
+
+        if not (0 < source <= len(player.queue) and 0 < target <= len(player.queue)):
+            embed = discord.Embed(description='Please enter two positions of the queue.', color=discord.Colour.purple())  
+            return await ctx.send(embed=set_style(embed), delete_after=8)
+
+        player.queue.move(source - 1, target - 1)
+        embed = discord.Embed(description=f'Moved {player.queue[target - 1].title} to position {target} of the queue.', color=discord.Colour.purple())  
+        await ctx.send(embed=set_style(embed), delete_after=8)
+
+    @commands.command(aliases=['jump'])
+    @commands.guild_only()
+    async def skipto(self, ctx: commands.Context, *, index: int):
+        '''Skips to the song at the given position of the queue.'''
+
+        player: Player = self.get_player(ctx)
+
+        if not player.is_connected:
+            return
+
+        if not self.is_privileged(ctx):
+            embed = discord.Embed(description='Only the DJ or admins may skip to a song of the queue.', color=discord.Colour.purple())  
+            return await ctx.send(embed=set_style(embed), delete_after=8)
+
+        if not 0 < index <= len(player.queue):
+            embed = discord.Embed(description=f'There is no song at position {index} of the queue.', color=discord.Colour.purple())  
+            return await ctx.send(embed=set_style(embed), delete_after=8)
+
+        player.queue.skip_to(index - 1)
+        embed = discord.Embed(description=f'Skipping to {player.queue[0].title}.', color=discord.Colour.purple())  
+        await ctx.send(embed=set_style(embed), delete_after=8)
+        await player.stop()
+
     @commands.command(aliases=['np', 'now_playing', 'current'])
     @commands.guild_only()
     async def nowplaying(self, ctx: commands.Context):
         '''Update the player controller.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             return
@@ -921,7 +1579,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
     async def swap_dj(self, ctx: commands.Context, *, member: discord.Member = None):
         '''Swap the current DJ to another member in the voice channel.'''
 
-        player: Player = self.bot.wavelink.get_player(guild_id=ctx.guild.id, cls=Player, context=ctx)
+        player: Player = self.get_player(ctx)
 
         if not player.is_connected:
             return
@@ -931,7 +1589,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
             return await ctx.send(embed=set_style(embed), delete_after=8)
             return await ctx.send('Only admins and the DJ may use this command.', delete_after=8)
 
-        members = self.bot.get_channel(int(player.channel_id)).members
+        members = player.listeners
 
         if member and member not in members:
             embed = discord.Embed(description=f'{member} is not currently in voice, so can not be a DJ.', color=discord.Colour.purple())  
@@ -941,7 +1599,7 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
             embed = discord.Embed(description='Cannot swap DJ to the current DJ... :)', color=discord.Colour.purple())  
             return await ctx.send(embed=set_style(embed), delete_after=8)
 
-        if len(members) <= 2:
+        if len(members) <= 1:
             embed = discord.Embed(description='No more members to swap to.', color=discord.Colour.purple())  
             return await ctx.send(embed=set_style(embed), delete_after=8)
 
@@ -951,11 +1609,11 @@ class MusicCog(commands.Cog, wavelink.WavelinkMixin, name='Music'):
             return await ctx.send(embed=set_style(embed), delete_after=8)
 
         for m in members:
-            if m == player.dj or m.bot:
+            if m == player.dj:
                 continue
             else:
                 player.dj = m
-                embed = discord.Embed(description=f'{member.mention} is now the DJ.', color=discord.Colour.purple())  
+                embed = discord.Embed(description=f'{m.mention} is now the DJ.', color=discord.Colour.purple())  
                 return await ctx.send(embed=set_style(embed), delete_after=8)
 
 
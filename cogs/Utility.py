@@ -448,6 +448,75 @@ class UtilityCog(commands.Cog, name='Utility', command_attrs=dict(hidden=True)):
         bot.help_command = HelpCommand()
         bot.help_command.cog = self
 
+        # Commands which the other clusters can run on this one.
+        self.cluster_commands = {'stats': self.local_stats, 'reload': self.reload_module, 'reloadall': self.reload_all_modules}
+        if getattr(bot, 'cluster', None) is not None:
+            bot.cluster.handlers.update(self.cluster_commands)
+
+    async def on_every_cluster(self, command, *args):
+        '''Runs one of the cluster commands on every cluster, or only on this process if the bot is not clustered.
+        Returns a dictionary of cluster ID -> (result, error), with an 'others' entry when the other clusters could not be reached.'''
+
+        cluster = getattr(self.bot, 'cluster', None)
+        if cluster is not None and cluster.is_connected:
+            try:
+                return await cluster.request(command, *args)
+            except (asyncio.TimeoutError, ConnectionError) as e:
+                # The command still runs on this process, the other clusters are reported as failed.
+                error = 'They did not answer in time.' if isinstance(e, asyncio.TimeoutError) else str(e)
+                self.bot.log.warning(f'Could not run {command} on every cluster: {error}')
+                results = await self.on_this_cluster(command, *args, cluster_id=cluster.cluster_id)
+                results['others'] = (None, error)
+                return results
+
+        return await self.on_this_cluster(command, *args)
+
+    async def on_this_cluster(self, command, *args, cluster_id=0):
+        '''Runs one of the cluster commands on this process only. Returns a dictionary of cluster ID -> (result, error).'''
+
+        try:
+            return {cluster_id: (await self.cluster_commands[command](*args), None)}
+        except Exception as e:
+            return {cluster_id: (None, str(e))}
+
+    async def local_stats(self):
+        '''Guilds and members seen by this process.'''
+
+        if getattr(self.bot, 'intents_profile', 'full') == 'full':
+            members = len(set(self.bot.get_all_members()))
+        else:
+            # Only some members are cached, so the counts sent by Discord are added up (members of several guilds count several times).
+            members = sum(guild.member_count for guild in self.bot.guilds)
+        return {'guilds': len(self.bot.guilds), 'members': members}
+
+    async def total_stats(self):
+        '''Guilds and members of every cluster. Members in guilds of several clusters are counted once per cluster.'''
+
+        results = await self.on_every_cluster('stats')
+        stats = [result for result, error in results.values() if result]
+        return sum(stat['guilds'] for stat in stats), sum(stat['members'] for stat in stats)
+
+    async def reload_module(self, name):
+        '''Reloads a cog of this process.'''
+
+        if not os.path.exists(f'cogs/{name}.py'):
+            raise ImportError(f'No module named `{name}.py`')
+        self.bot.reload_extension(f'cogs.{name}')
+
+    async def reload_all_modules(self):
+        '''Reloads every cog loaded by this process.'''
+
+        for name in list(self.bot.extensions):
+            self.bot.reload_extension(name)
+
+    def cluster_errors(self, results):
+        '''Joins the errors of the clusters which failed to run a command.'''
+
+        errors = [(cluster, error) for cluster, (result, error) in sorted(results.items(), key=lambda item: str(item[0])) if error]
+        if len(results) == 1:
+            return '\n'.join(error for _, error in errors)
+        return '\n'.join(f'{"Other clusters" if cluster == "others" else f"Cluster {cluster}"}: {error}' for cluster, error in errors)
+
     @commands.command()
     @commands.is_owner()
     async def shutdown(self, ctx):
@@ -486,16 +555,12 @@ class UtilityCog(commands.Cog, name='Utility', command_attrs=dict(hidden=True)):
     @commands.command()
     @commands.is_owner()
     async def reload(self, ctx, *, msg):
-        '''Reloads a module.'''
+        '''Reloads a module on every cluster.'''
 
-        try:
-            if os.path.exists(f'cogs/{msg}.py'):
-                self.bot.reload_extension(f'cogs.{msg}')
-            else:
-                raise ImportError(f'No module named `{msg}.py`')
-        except Exception as e:
-            message = f'Failed to reload module: `{msg}.py`: {e}'
-            return await ctx.send(embed=embed_error(message, input1=ctx, input2=e))
+        errors = self.cluster_errors(await self.on_every_cluster('reload', msg))
+        if errors:
+            message = f'Failed to reload module: `{msg}.py`: {errors}'
+            return await ctx.send(embed=embed_error(message, input1=ctx))
         else:
             embed = discord.Embed(description=f'Module `{msg}` has been reloaded succesfully.', color=discord.Colour.purple())  
             return await ctx.send(embed=set_style(embed))
@@ -503,21 +568,11 @@ class UtilityCog(commands.Cog, name='Utility', command_attrs=dict(hidden=True)):
     @commands.command()
     @commands.is_owner()
     async def reloadall(self, ctx):
-        """ Reloads all extensions. """
-        error_collection = []
-        for file in os.listdir('cogs'):
-            if file.endswith('.py'):
-                name = file[:-3]
-                try:
-                    if os.path.exists(f'cogs/{name}.py'):
-                        self.bot.reload_extension(f'cogs.{name}')
-                    else:
-                        raise ImportError(f'No module named `{name}.py`')
-                except Exception as e:
-                    message = f'Failed to reload module: `{name}.py`: {e}'
-                    return await ctx.send(embed=embed_error(message, input1=ctx, input2=e))
-                else:
-                    pass
+        """ Reloads all extensions on every cluster. """
+        errors = self.cluster_errors(await self.on_every_cluster('reloadall'))
+        if errors:
+            message = f'Failed to reload the modules: {errors}'
+            return await ctx.send(embed=embed_error(message, input1=ctx))
         embed = discord.Embed(description='Successfully reloaded all extensions', color=discord.Colour.purple())  
         await ctx.send(embed=set_style(embed))
 
@@ -563,19 +618,21 @@ class UtilityCog(commands.Cog, name='Utility', command_attrs=dict(hidden=True)):
     async def membercount(self, ctx):
         '''Subcomand for "status" that changes the status of the bot a count of guilds where it is in.'''
 
-        await self.bot.change_presence(activity=discord.Activity(name=f'on {len(self.bot.guilds)} servers', type=1))
+        guilds, _ = await self.total_stats()
+        await self.bot.change_presence(activity=discord.Activity(name=f'on {guilds} servers', type=1))
 
     @commands.command(hidden=False)
     async def info(self, ctx):
         '''Displays general information about the bot'''
 
+        guilds, members = await self.total_stats()
         embed = discord.Embed(title=f'{self.bot.user.name} Information', description='\uFEFF', color=discord.Colour.purple(), timestamp = ctx.message.created_at)
 
         embed.add_field(name='Bot version:', value=self.bot.version)
         embed.add_field(name='Python Version:', value=platform.python_version())
         embed.add_field(name='Discord.py Version:', value=discord.__version__)
-        embed.add_field(name='Total Guilds:', value=len(self.bot.guilds))
-        embed.add_field(name='Total Users:', value=len(set(self.bot.get_all_members())))
+        embed.add_field(name='Total Guilds:', value=guilds)
+        embed.add_field(name='Total Users:', value=members)
         embed.add_field(name='Bot Developer:', value='<@125345019199488000>')
         embed.set_author(name=self.bot.user.name, icon_url=self.bot.user.avatar_url)
         await ctx.send(embed=set_style(embed))
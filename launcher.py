@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sys
+import discord
+
+from dotenv import load_dotenv
+from utilities.ipc import Supervisor
+from utilities.sharding import cluster_shards
+
+# Starts the bot spread over several processes (clusters), each one running some of the shards.
+# CLUSTERS sets the number of processes and SHARD_COUNT the total number of shards ('auto' asks Discord for it).
+# Every cluster runs ShunyaBOT.py with SHARD_COUNT, SHARD_IDS and CLUSTER_ID set in its environment, together with the
+# address of the supervisor, which starts crashed clusters again and relays the commands run on every cluster.
+
+dotenv_path = os.path.join(f'{os.path.dirname(sys.argv[0])}/config', '.env')
+load_dotenv(dotenv_path)
+bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ShunyaBOT.py')
+
+async def recommended_shards(token):
+    '''Asks Discord for the recommended number of shards of the bot.'''
+
+    http = discord.http.HTTPClient()
+    try:
+        await http.static_login(token, bot=True)
+        shards, _ = await http.get_bot_gateway()
+    finally:
+        await http.close()
+    return shards
+
+def get_shard_count():
+    shard_count = os.getenv('SHARD_COUNT') or 'auto'
+    if shard_count == 'auto':
+        return asyncio.get_event_loop().run_until_complete(recommended_shards(os.getenv('DISCORD_TOKEN')))
+    return int(shard_count)
+
+def main():
+    shard_count = get_shard_count()
+    clusters = {cluster_id: {'SHARD_COUNT': str(shard_count), 'SHARD_IDS': ','.join(map(str, shard_ids))}
+                for cluster_id, shard_ids in enumerate(cluster_shards(shard_count, int(os.getenv('CLUSTERS', 1))))}
+
+    for cluster_id, cluster in clusters.items():
+        print(f'Cluster {cluster_id} runs shards {cluster["SHARD_IDS"]} of {shard_count}.')
+
+    supervisor = Supervisor([sys.executable, bot_path], clusters, authkey=os.urandom(32), env=os.environ)
+    supervisor.run(restart_delay=int(os.getenv('CLUSTER_RESTART_DELAY', 5)))
+
+if __name__ == '__main__':
+    main()
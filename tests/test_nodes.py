@@ -0,0 +1,209 @@
+import asyncio
+
+from utilities.nodes import is_healthy, migrate_player, node_penalty, rebalance, select_node
+
+class FakeStats:
+    def __init__(self, playing_players=0, system_load=0.0, frames_deficit=-1, frames_nulled=-1):
+        self.playing_players = playing_players
+        self.system_load = system_load
+        self.frames_deficit = frames_deficit
+        self.frames_nulled = frames_nulled
+
+class FakeNode:
+    def __init__(self, identifier, stats=None, players=0, region=None, available=True):
+        self.identifier = identifier
+        self.stats = stats
+        self.players = {guild_id: object() for guild_id in range(players)}
+        self.region = region
+        self.is_available = available
+
+class FakePlayer:
+    def __init__(self, node, eq=None):
+        self.node = node
+        self.eq = eq
+        self.calls = []
+
+    async def change_node(self, identifier):
+        self.calls.append(('change_node', identifier))
+
+    async def set_eq(self, eq):
+        self.calls.append(('set_eq', eq))
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def test_penalty_counts_playing_players_and_load():
+    assert node_penalty(FakeNode('a', FakeStats(playing_players=3))) == 3
+    assert node_penalty(FakeNode('a', FakeStats(playing_players=3, system_load=0.5))) > 3
+
+def test_penalty_without_stats_counts_players():
+    assert node_penalty(FakeNode('a', players=4)) == 4
+
+def test_least_loaded_node_is_selected():
+    busy = FakeNode('busy', FakeStats(playing_players=10))
+    idle = FakeNode('idle', FakeStats(playing_players=2))
+    assert select_node([busy, idle]) is idle
+
+def test_weights_divide_the_penalty():
+    small = FakeNode('small', FakeStats(playing_players=4))
+    large = FakeNode('large', FakeStats(playing_players=6))
+    assert select_node([small, large]) is small
+    assert select_node([small, large], weights={'large': 2}) is large
+
+def test_region_is_preferred():
+    local = FakeNode('local', FakeStats(playing_players=10), region='europe')
+    remote = FakeNode('remote', FakeStats(playing_players=1), region='us-east')
+    assert select_node([local, remote], region='europe') is local
+    assert select_node([local, remote], region='brazil') is remote
+    assert select_node([local, remote]) is remote
+
+def test_unavailable_nodes_are_skipped():
+    down = FakeNode('down', FakeStats(), region='europe', available=False)
+    up = FakeNode('up', FakeStats(playing_players=50), region='us-east')
+    assert select_node([down, up], region='europe') is up
+    assert select_node([down]) is None
+    assert select_node([]) is None
+
+def test_nodes_without_stats_are_ranked_by_players():
+    fresh = FakeNode('fresh', players=1)
+    loaded = FakeNode('loaded', FakeStats(playing_players=5))
+    assert select_node([fresh, loaded]) is fresh
+    assert select_node([FakeNode('full', players=8), FakeNode('empty')]).identifier == 'empty'
+
+def test_health_uses_the_weighted_penalty():
+    node = FakeNode('large', FakeStats(playing_players=30))
+    assert not is_healthy(node, 20)
+    assert is_healthy(node, 20, weights={'large': 2})
+    assert not is_healthy(FakeNode('down', FakeStats(), available=False), 20)
+
+def test_moved_players_count_until_the_next_stats():
+    node = FakeNode('a', FakeStats(playing_players=19))
+    assert is_healthy(node, 20)
+    assert not is_healthy(node, 20, moved={'a': 2})
+    # Without stats the players of the node already include the moved ones.
+    assert node_penalty(FakeNode('b', players=3)) == 3
+    assert is_healthy(FakeNode('b', players=3), 3, moved={'b': 5})
+
+def test_player_moves_to_the_least_loaded_healthy_node():
+    old = FakeNode('old', FakeStats(playing_players=100))
+    busy = FakeNode('busy', FakeStats(playing_players=9))
+    free = FakeNode('free', FakeStats(playing_players=1))
+    player = FakePlayer(old, eq='boost')
+    moved = {}
+
+    assert run(migrate_player(player, [old, busy, free], max_penalty=10, moved=moved)) is free
+    assert player.calls == [('change_node', 'free'), ('set_eq', 'boost')]
+    assert moved == {'free': 1, 'old': -1}
+
+def test_eq_is_not_set_without_one():
+    player = FakePlayer(FakeNode('old', available=False))
+    run(migrate_player(player, [player.node, FakeNode('new')], max_penalty=10))
+    assert player.calls == [('change_node', 'new')]
+
+def test_no_healthy_node():
+    old = FakeNode('old', available=False)
+    player = FakePlayer(old, eq='boost')
+    nodes = [old, FakeNode('down', available=False), FakeNode('full', FakeStats(playing_players=50))]
+
+    assert run(migrate_player(player, nodes, max_penalty=10)) is None
+    assert player.calls == []
+
+def test_moves_fill_the_target_nodes():
+    old = FakeNode('old', FakeStats(playing_players=100))
+    a = FakeNode('a', FakeStats(playing_players=8))
+    b = FakeNode('b', FakeStats(playing_players=9))
+    moved = {}
+
+    targets = [run(migrate_player(FakePlayer(old), [old, a, b], max_penalty=10, moved=moved)).identifier for _ in range(5)]
+    assert targets == ['a', 'a', 'b', 'a', 'b']
+    assert moved == {'a': 3, 'b': 2, 'old': -5}
+    assert run(migrate_player(FakePlayer(old), [old, a, b], max_penalty=10, moved=moved)) is None
+
+class StubPlayer:
+    '''Player which really moves between the players of the fake nodes.'''
+
+    def __init__(self, guild_id, node, nodes, is_playing=True):
+        self.guild_id = guild_id
+        self.node = node
+        self.nodes = nodes
+        self.eq = None
+        self.is_playing = is_playing
+        node.players[guild_id] = self
+
+    async def change_node(self, identifier):
+        del self.node.players[self.guild_id]
+        self.node = self.nodes[identifier]
+        self.node.players[self.guild_id] = self
+
+def stub_nodes(*nodes):
+    return {node.identifier: node for node in nodes}
+
+def stub_players(node, nodes, playing, idle=0):
+    return [StubPlayer(guild_id, node, nodes, is_playing=guild_id < playing) for guild_id in range(playing + idle)]
+
+def rebalance_with(nodes, max_penalty=10, on_move=None):
+    calls = []
+
+    async def move(player, moved):
+        calls.append(player.guild_id)
+        target = await migrate_player(player, nodes.values(), max_penalty, moved=moved)
+        if on_move is not None:
+            on_move(player)
+        return target is not None
+
+    count = run(rebalance(nodes.values(), move, max_penalty))
+    return count, calls
+
+def test_every_player_of_a_disconnected_node_is_moved():
+    down = FakeNode('down', FakeStats(playing_players=2), available=False)
+    up = FakeNode('up', FakeStats(playing_players=0))
+    nodes = stub_nodes(down, up)
+    stub_players(down, nodes, playing=2, idle=2)
+
+    assert rebalance_with(nodes)[0] == 4
+    assert not down.players and len(up.players) == 4
+
+def test_overloaded_node_only_loses_playing_players_until_healthy():
+    busy = FakeNode('busy', FakeStats(playing_players=12))
+    free = FakeNode('free', FakeStats(playing_players=0))
+    nodes = stub_nodes(busy, free)
+    stub_players(busy, nodes, playing=5, idle=3)
+
+    count, calls = rebalance_with(nodes)
+    assert count == 2 and calls == [0, 1]
+    assert sorted(free.players) == [0, 1]
+    assert all(player.is_playing for player in free.players.values())
+
+def test_healthy_nodes_are_left_alone():
+    a = FakeNode('a', FakeStats(playing_players=3))
+    b = FakeNode('b', FakeStats(playing_players=0))
+    nodes = stub_nodes(a, b)
+    stub_players(a, nodes, playing=3)
+
+    assert rebalance_with(nodes) == (0, [])
+
+def test_pass_stops_when_no_node_can_take_the_players():
+    down = FakeNode('down', available=False)
+    full = FakeNode('full', FakeStats(playing_players=50))
+    nodes = stub_nodes(down, full)
+    stub_players(down, nodes, playing=3)
+
+    assert rebalance_with(nodes) == (0, [0])
+    assert len(down.players) == 3
+
+def test_node_disconnecting_during_the_pass_loses_every_player():
+    busy = FakeNode('busy', FakeStats(playing_players=30))
+    free = FakeNode('free', FakeStats(playing_players=0))
+    nodes = stub_nodes(busy, free)
+    stub_players(busy, nodes, playing=1, idle=3)
+
+    def disconnect(player):
+        busy.is_available = False
+
+    count, calls = rebalance_with(nodes, max_penalty=20, on_move=disconnect)
+    assert count == 4 and calls == [0, 1, 2, 3]
+    assert not busy.players
@@ -0,0 +1,75 @@
+import collections
+import time
+
+class LRUCache:
+    '''Dictionary-like cache which holds at most maxsize entries.
+       When it is full, the least recently used entry is evicted to make room for the new one.'''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def get(self, key, default=None):
+        '''Returns the value stored for key and marks it as recently used.'''
+
+        try:
+            value = self._data[key]
+        except KeyError:
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        '''Stores value for key, evicting the least recently used entry when needed.'''
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+class TTLCache(LRUCache):
+    '''LRU cache whose entries expire ttl seconds after being stored. Keeps count of its hits and misses.'''
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        super().__init__(maxsize)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        '''Returns the value stored for key if it has not expired yet.'''
+
+        entry = super().get(key)
+        if entry is not None and entry[1] <= time.monotonic():
+            self._data.pop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, ttl=None):
+        '''Stores value for key during ttl seconds, or the default ttl of the cache.'''
+
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        super().put(key, (value, expires))
+
+    def pop(self, key, default=None):
+        entry = super().pop(key)
+        return default if entry is None else entry[0]
@@ -1,160 +1,656 @@
 import aiosqlite
+import asyncio
 import os
+import sqlite3
 import sys, traceback
 
+from utilities.cache import LRUCache
+
 database_path = os.path.join(f'{os.path.dirname(sys.argv[0])}/config', 'database.sqlite')
 
-# Creates a connection to the database.
-async def db_connect():
-    database = await aiosqlite.connect(database_path)
-    return database
+# Pragma profiles applied to every pooled connection, selected with DATABASE_PROFILE in the .env file.
+# The database always runs in WAL mode, so readers are not blocked by writers and a commit does not need a full fsync
+# with synchronous=NORMAL. cache_size is given in KiB when negative, mmap_size in bytes.
+pragma_profiles = {
+    'safe': {'synchronous': 'FULL', 'cache_size': -2000, 'mmap_size': 0, 'temp_store': 'DEFAULT'},
+    'balanced': {'synchronous': 'NORMAL', 'cache_size': -8000, 'mmap_size': 2**26, 'temp_store': 'MEMORY'},
+    'performance': {'synchronous': 'NORMAL', 'cache_size': -32000, 'mmap_size': 2**28, 'temp_store': 'MEMORY'}
+}
+
+class ConnectionPool:
+    '''Keeps a fixed amount of aiosqlite connections open and lends them out to the database helpers.
+
+    Every aiosqlite connection runs its own background thread, so opening one per query is expensive.
+    The pool opens its connections once and hands them out with `async with pool.acquire() as database:`.'''
+
+    def __init__(self, path, size=None, pragmas=None):
+        self.path = path
+        self.size = size
+        self.pragmas = pragmas
+        self._connections = []
+        self._idle = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_open(self):
+        return self._idle is not None
+
+    async def open(self):
+        '''Opens the connections of the pool. Calling it on an already open pool does nothing.'''
+
+        async with self._lock:
+            if self.is_open:
+                return
+            # The settings are read on open since the configuration is loaded after this module is imported.
+            if self.size is None:
+                self.size = int(os.getenv('DATABASE_POOL_SIZE', 4))
+            if self.pragmas is None:
+                self.pragmas = pragma_profiles[os.getenv('DATABASE_PROFILE', 'balanced')]
+            idle = asyncio.Queue()
+            for _ in range(self.size):
+                database = await aiosqlite.connect(self.path)
+                await self.configure(database)
+                self._connections.append(database)
+                idle.put_nowait(database)
+            self._idle = idle
+
+    async def configure(self, database):
+        '''Applies the pragma profile to a new connection. These pragmas only last for the connection.'''
+
+        for pragma, value in self.pragmas.items():
+            # Some pragmas return a row: the cursor is closed so the statement does not keep the database locked.
+            cursor = await database.execute(f'PRAGMA {pragma} = {value}')
+            await cursor.close()
+
+    async def close(self):
+        '''Closes every connection of the pool.'''
+
+        async with self._lock:
+            if not self.is_open:
+                return
+            self._idle = None
+            for database in self._connections:
+                await database.close()
+            self._connections.clear()
+
+    def acquire(self):
+        '''Borrows a connection from the pool, to be used as an async context manager. Raises RuntimeError if the pool is not open.'''
+
+        return PooledConnection(self)
+
+class PooledConnection:
+    '''Async context manager returned by ConnectionPool.acquire().
+       Rolls back the pending transaction if the block raised and gives the connection back to the pool.'''
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.database = None
+
+    async def __aenter__(self):
+        # The pool is opened once at start-up and closed once the bot has logged out, reopening it would leak connections.
+        if not self.pool.is_open:
+            raise RuntimeError('The database connection pool is not open.')
+        self.database = await self.pool._idle.get()
+        return self.database
+
+    async def __aexit__(self, exc_type, exc, tb):
+        database, self.database = self.database, None
+        if exc_type is not None:
+            await database.rollback()
+        # The pool might have been closed while the connection was borrowed.
+        if self.pool.is_open:
+            self.pool._idle.put_nowait(database)
+
+pool = ConnectionPool(database_path)
+checkpoint_task = None
+
+# Opens the connection pool, used once at start-up.
+async def open_pool():
+    return await pool.open()
+
+# Closes the connection pool, used once the bot has logged out and the cogs have been unloaded.
+async def close_pool():
+    global checkpoint_task
+    if checkpoint_task is not None:
+        checkpoint_task.cancel()
+        checkpoint_task = None
+        # Leave the whole log in the main database file so it can be copied around safely.
+        await checkpoint('TRUNCATE')
+    return await pool.close()
+
+# Initialises the database: opens the pool, switches the file to WAL mode and starts the periodic checkpoints.
+async def init_database():
+    global checkpoint_task
+    await open_pool()
+    async with pool.acquire() as database:
+        # The journal mode is stored in the database file, so it is enough to set it once from any connection.
+        cursor = await database.execute('PRAGMA journal_mode = WAL')
+        await cursor.close()
+    if checkpoint_task is None:
+        interval = int(os.getenv('DATABASE_CHECKPOINT_INTERVAL', 300))
+        checkpoint_task = asyncio.get_event_loop().create_task(checkpoint_loop(interval))
+
+# Moves the content of the WAL file back into the database file.
+async def checkpoint(mode='PASSIVE'):
+    return await fetchone(f'PRAGMA wal_checkpoint({mode})')
+
+# Runs a passive checkpoint every interval seconds so the WAL file does not keep growing.
+async def checkpoint_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await checkpoint()
+        except Exception:
+            traceback.print_exc()
+
+# Schema migrations, applied in order inside a transaction each.
+# The number of migrations already applied to the database is kept in PRAGMA user_version.
+# Never edit a migration that has been released: append a new one instead.
+migrations = [
+    # 1: Original schema. Databases created before the migrations existed already have it.
+    '''
+    CREATE TABLE IF NOT EXISTS welcome(
+    guild_id TEXT,
+    welcome_msg TEXT,
+    welcome_channel_id TEXT,
+    welcome_channel_on INTEGER,
+    welcome_role_id TEXT,
+    welcome_role_on INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS reaction(
+    emoji TEXT,
+    role TEXT,
+    message_id TEXT,
+    channel_id TEXT,
+    guild_id TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS music(
+    member_id TEXT,
+    favourite1 TEXT,
+    favourite2 TEXT,
+    favourite3 TEXT,
+    favourite4 TEXT,
+    favourite5 TEXT,
+    favourite6 TEXT,
+    favourite7 TEXT,
+    favourite8 TEXT,
+    favourite9 TEXT,
+    favourite10 TEXT
+    );
+    ''',
+    # 2: Snowflakes are stored as INTEGER, every table gets a key and the reaction lookups get a unique index.
+    #    Duplicated rows are dropped, keeping the oldest one.
+    '''
+    CREATE TABLE welcome_new(
+    guild_id INTEGER PRIMARY KEY,
+    welcome_msg TEXT,
+    welcome_channel_id INTEGER,
+    welcome_channel_on INTEGER NOT NULL DEFAULT 0,
+    welcome_role_id INTEGER,
+    welcome_role_on INTEGER NOT NULL DEFAULT 0
+    );
+
+    INSERT OR IGNORE INTO welcome_new
+    SELECT CAST(guild_id AS INTEGER), welcome_msg, CAST(welcome_channel_id AS INTEGER), COALESCE(welcome_channel_on, 0),
+           CAST(welcome_role_id AS INTEGER), COALESCE(welcome_role_on, 0)
+    FROM welcome WHERE guild_id IS NOT NULL ORDER BY rowid;
+
+    DROP TABLE welcome;
+    ALTER TABLE welcome_new RENAME TO welcome;
+
+    CREATE TABLE reaction_new(
+    guild_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    emoji TEXT NOT NULL,
+    role INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL
+    );
+
+    INSERT INTO reaction_new
+    SELECT CAST(guild_id AS INTEGER), CAST(message_id AS INTEGER), emoji, CAST(role AS INTEGER), CAST(channel_id AS INTEGER)
+    FROM reaction
+    WHERE rowid IN (SELECT MIN(rowid) FROM reaction
+                    WHERE guild_id IS NOT NULL AND message_id IS NOT NULL AND emoji IS NOT NULL
+                    AND role IS NOT NULL AND channel_id IS NOT NULL
+                    GROUP BY CAST(guild_id AS INTEGER), CAST(message_id AS INTEGER), emoji);
+
+    DROP TABLE reaction;
+    ALTER TABLE reaction_new RENAME TO reaction;
+    CREATE UNIQUE INDEX reaction_lookup ON reaction(guild_id, message_id, emoji);
+
+    CREATE TABLE music_new(
+    member_id INTEGER PRIMARY KEY,
+    favourite1 TEXT,
+    favourite2 TEXT,
+    favourite3 TEXT,
+    favourite4 TEXT,
+    favourite5 TEXT,
+    favourite6 TEXT,
+    favourite7 TEXT,
+    favourite8 TEXT,
+    favourite9 TEXT,
+    favourite10 TEXT
+    );
+
+    INSERT OR IGNORE INTO music_new
+    SELECT CAST(member_id AS INTEGER), favourite1, favourite2, favourite3, favourite4, favourite5,
+           favourite6, favourite7, favourite8, favourite9, favourite10
+    FROM music WHERE member_id IS NOT NULL ORDER BY rowid;
+
+    DROP TABLE music;
+    ALTER TABLE music_new RENAME TO music;
+    ''',
+    # 3: Favourites are stored one row per track instead of ten columns per member.
+    #    Positions start at 1 and are kept contiguous by a trigger when a favourite is deleted.
+    '''
+    CREATE TABLE favourites(
+    member_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    uri TEXT NOT NULL,
+    title TEXT,
+    length INTEGER
+    );
+
+    CREATE INDEX favourites_member ON favourites(member_id, position);
+
+    CREATE TRIGGER favourites_compact AFTER DELETE ON favourites
+    BEGIN
+        UPDATE favourites SET position = position - 1 WHERE member_id = old.member_id AND position > old.position;
+    END;
+
+    INSERT INTO favourites(member_id, position, uri)
+    SELECT member_id, ROW_NUMBER() OVER (PARTITION BY member_id ORDER BY slot), uri FROM (
+              SELECT member_id, 1 AS slot, favourite1 AS uri FROM music WHERE favourite1 IS NOT NULL
+    UNION ALL SELECT member_id, 2, favourite2 FROM music WHERE favourite2 IS NOT NULL
+    UNION ALL SELECT member_id, 3, favourite3 FROM music WHERE favourite3 IS NOT NULL
+    UNION ALL SELECT member_id, 4, favourite4 FROM music WHERE favourite4 IS NOT NULL
+    UNION ALL SELECT member_id, 5, favourite5 FROM music WHERE favourite5 IS NOT NULL
+    UNION ALL SELECT member_id, 6, favourite6 FROM music WHERE favourite6 IS NOT NULL
+    UNION ALL SELECT member_id, 7, favourite7 FROM music WHERE favourite7 IS NOT NULL
+    UNION ALL SELECT member_id, 8, favourite8 FROM music WHERE favourite8 IS NOT NULL
+    UNION ALL SELECT member_id, 9, favourite9 FROM music WHERE favourite9 IS NOT NULL
+    UNION ALL SELECT member_id, 10, favourite10 FROM music WHERE favourite10 IS NOT NULL
+    );
+
+    DROP TABLE music;
+    ''',
+    # 4: Favourites keep the encoded Lavalink track and its identifier, so they can be queued without resolving them again.
+    '''
+    ALTER TABLE favourites ADD COLUMN track TEXT;
+    ALTER TABLE favourites ADD COLUMN identifier TEXT;
+    ''',
+    # 5: Snapshots of the music players, so their queues survive a restart of the bot or a reload of the Music cog.
+    '''
+    CREATE TABLE music_sessions (
+    guild_id INTEGER PRIMARY KEY,
+    voice_channel_id INTEGER,
+    text_channel_id INTEGER,
+    message_id INTEGER,
+    dj_id INTEGER,
+    volume INTEGER,
+    paused INTEGER,
+    position INTEGER,
+    track TEXT,
+    info TEXT,
+    requester_id INTEGER
+    );
+
+    CREATE TABLE music_queue (
+    guild_id INTEGER,
+    position INTEGER,
+    track TEXT,
+    info TEXT,
+    requester_id INTEGER,
+    PRIMARY KEY (guild_id, position)
+    );
+    ''',
+    # 6: Custom command prefixes of the guilds. Guilds without rows use the default prefixes.
+    '''
+    CREATE TABLE prefixes (
+    guild_id INTEGER,
+    prefix TEXT,
+    PRIMARY KEY (guild_id, prefix)
+    );
+    ''',
+    # 7: Migration 3 used to keep the old column numbers as positions, leaving gaps where a column was empty.
+    #    The positions of every member are numbered 1..N again, keeping their order.
+    '''
+    CREATE TEMP TABLE favourites_positions AS
+    SELECT rowid AS id, ROW_NUMBER() OVER (PARTITION BY member_id ORDER BY position) AS position FROM favourites;
+
+    UPDATE favourites SET position = (SELECT position FROM favourites_positions WHERE id = favourites.rowid);
+
+    DROP TABLE favourites_positions;
+    '''
+]
+
+# Splits a migration script into its statements, keeping the body of a trigger together.
+def split_script(script):
+    statements, statement = [], ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement.strip())
+            statement = ''
+    return statements
+
+# Brings the database schema up to date, upgrading existing databases in place.
+# Several clusters may start at the same time on the same file, so every migration takes the write lock first and reads
+# the version again inside its transaction: a cluster which waited for the lock sees the migrations the other one applied.
+async def migrate():
+    applied = 0
+    async with pool.acquire() as database:
+        while True:
+            await database.execute('BEGIN IMMEDIATE')
+            cursor = await database.execute('PRAGMA user_version')
+            version = (await cursor.fetchone())[0]
+            await cursor.close()
+            if version >= len(migrations):
+                await database.rollback()
+                return applied
+            for statement in split_script(migrations[version]):
+                await database.execute(statement)
+            await database.execute(f'PRAGMA user_version = {version + 1}')
+            await database.commit()
+            applied += 1
 
 # Creates the necessary tables if needed.
 async def create_tables():
-    database = await db_connect()
-    cursor = await database.cursor()
-    await cursor.executescript('''
-        CREATE TABLE IF NOT EXISTS welcome(
-        guild_id TEXT,
-        welcome_msg TEXT,
-        welcome_channel_id TEXT,
-        welcome_channel_on INTEGER,
-        welcome_role_id TEXT,
-        welcome_role_on INTEGER
-        );
-
-        CREATE TABLE IF NOT EXISTS reaction(
-        emoji TEXT,
-        role TEXT,
-        message_id TEXT,
-        channel_id TEXT,
-        guild_id TEXT
-        );
-
-        CREATE TABLE IF NOT EXISTS music(
-        member_id TEXT,
-        favourite1 TEXT,
-        favourite2 TEXT,
-        favourite3 TEXT,
-        favourite4 TEXT,
-        favourite5 TEXT,
-        favourite6 TEXT,
-        favourite7 TEXT,
-        favourite8 TEXT,
-        favourite9 TEXT,
-        favourite10 TEXT
-        );
-    ''')
-    return await commit_and_close(database, cursor)
-
-# Executes a query and closes both the cursor and the database
-async def execute_and_close(database, sql, val):
-    cursor = await database.cursor()
-    await cursor.execute(sql, val)
-    return await commit_and_close(database, cursor)
-
-# Commits the last change and closes both the cursor and the database
-async def commit_and_close(database, cursor):
-    await database.commit()
-    await cursor.close()
-    return await database.close()
-
-# Close the cursor and the database
-async def closeAll(database, cursor):
-    await cursor.close()
-    return await database.close()
+    return await migrate()
+
+# Executes a query on a pooled connection and commits it
+async def execute(sql, val=()):
+    async with pool.acquire() as database:
+        cursor = await database.execute(sql, val)
+        await database.commit()
+        await cursor.close()
+        return cursor.rowcount
+
+# Executes a query on a pooled connection and returns the first row
+async def fetchone(sql, val=()):
+    async with pool.acquire() as database:
+        cursor = await database.execute(sql, val)
+        result = await cursor.fetchone()
+        await cursor.close()
+        return result
+
+# Executes a query on a pooled connection and returns every row
+async def fetchall(sql, val=()):
+    async with pool.acquire() as database:
+        cursor = await database.execute(sql, val)
+        result = await cursor.fetchall()
+        await cursor.close()
+        return result
+
+class WelcomeSettings:
+    '''Welcome row of a guild. IDs are integers (or None when unset) and the switches are 0 or 1.'''
+
+    __slots__ = ('guild_id', 'welcome_msg', 'welcome_channel_id', 'welcome_channel_on', 'welcome_role_id', 'welcome_role_on')
+
+    columns = __slots__
+
+    def __init__(self, guild_id, welcome_msg=None, welcome_channel_id=None, welcome_channel_on=0, welcome_role_id=None, welcome_role_on=0):
+        self.guild_id = int(guild_id)
+        self.welcome_msg = welcome_msg
+        self.welcome_channel_id = None if welcome_channel_id is None else int(welcome_channel_id)
+        self.welcome_channel_on = welcome_channel_on or 0
+        self.welcome_role_id = None if welcome_role_id is None else int(welcome_role_id)
+        self.welcome_role_on = welcome_role_on or 0
+
+    def __repr__(self):
+        return f'<WelcomeSettings guild_id={self.guild_id} channel={self.welcome_channel_id} role={self.welcome_role_id}>'
+
+welcome_select = f"SELECT {', '.join(WelcomeSettings.columns)} FROM welcome"
+
+# SQLite refuses statements with more than 999 parameters, so batches are split in chunks of this size.
+batch_size = 500
+
+# Returns the whole welcome row of a guild, or None if the guild is not in the database
+async def get_welcome_settings(guildID):
+    row = await fetchone(f"{welcome_select} WHERE guild_id = ?", (guildID, ))
+    return None if row is None else WelcomeSettings(*row)
+
+# Returns the welcome rows of many guilds as a dictionary keyed by guild ID, skipping the unknown guilds
+async def get_welcome_settings_many(guildIDs):
+    guildIDs = list(guildIDs)
+    result = {}
+    for start in range(0, len(guildIDs), batch_size):
+        chunk = guildIDs[start:start + batch_size]
+        rows = await fetchall(f"{welcome_select} WHERE guild_id IN ({', '.join('?' * len(chunk))})", chunk)
+        for row in rows:
+            settings = WelcomeSettings(*row)
+            result[settings.guild_id] = settings
+    return result
+
+class GuildSettings(LRUCache):
+    '''In-memory copy of the welcome table, keyed by guild ID.
+
+    Every entry is the WelcomeSettings of a guild, so a member join needs a single lookup.
+    The writers of this module update it after committing (write-through), and guilds the bot has left are evicted.'''
+
+    async def load(self, guildIDs=None):
+        '''Loads the settings in bulk, used at start-up. Loads every guild unless guildIDs is given.'''
+
+        self.maxsize = int(os.getenv('GUILD_SETTINGS_CACHE_SIZE', self.maxsize))
+        if guildIDs is None:
+            rows = await fetchall(welcome_select)
+            settings = (WelcomeSettings(*row) for row in rows)
+        else:
+            settings = (await get_welcome_settings_many(guildIDs)).values()
+        for entry in settings:
+            self.put(entry.guild_id, entry)
+
+    async def fetch(self, guildID):
+        '''Returns the settings of a guild, reading the database only when they are not cached.'''
+
+        settings = self.get(int(guildID))
+        if settings is None:
+            settings = await get_welcome_settings(guildID)
+            if settings is None:
+                return None
+            self.put(settings.guild_id, settings)
+        return settings
+
+    def update(self, guildID, column, value):
+        '''Updates a cached column after it was written. Guilds that are not cached are read again on their next use.'''
+
+        settings = self.get(int(guildID))
+        if settings is not None:
+            setattr(settings, column, value)
+
+    def retain(self, guildIDs):
+        '''Evicts every cached guild that is not in guildIDs, i.e. the guilds the bot has left.'''
+
+        guildIDs = set(guildIDs)
+        for guildID in [guildID for guildID in self if guildID not in guildIDs]:
+            self.pop(guildID)
+
+guild_settings = GuildSettings(maxsize=10000)
 
 # Add a guild to the database
 async def add_guild(guildID):
-    database = await db_connect()
-    sql = ('INSERT INTO welcome(guild_id, welcome_channel_on, welcome_role_on) VALUES(?, ?, ?)')
+    sql = ('INSERT OR IGNORE INTO welcome(guild_id, welcome_channel_on, welcome_role_on) VALUES(?, ?, ?)')
     val = (guildID, 0, 0)
-    return await execute_and_close(database, sql, val)
+    result = await execute(sql, val)
+    if result:
+        guild_settings.put(int(guildID), WelcomeSettings(guildID))
+    else:
+        # The guild was already there, e.g. the bot was removed while offline. Its settings are read again on use.
+        guild_settings.pop(int(guildID))
+    return result
 
 # Remove a guild from the database
 async def remove_guild(guildID):
-    database = await db_connect()
     sql = ('DELETE FROM welcome WHERE guild_id = ?')
-    await cursor.execute(sql, (guildID, ))
-    return await commit_and_close(database, cursor)
+    result = await execute(sql, (guildID, ))
+    guild_settings.pop(int(guildID))
+    return result
+
+# Updates a column of the welcome settings of a guild, both in the database and in the cache
+async def set_welcome_setting(column, value, guildID):
+    sql = (f"UPDATE welcome SET {column} = ? WHERE guild_id = ?")
+    val = (value, guildID)
+    result = await execute(sql, val)
+    guild_settings.update(guildID, column, value)
+    return result
+
+# Returns the cached welcome settings of a guild
+async def get_guild_settings(guildID):
+    return await guild_settings.fetch(guildID)
 
 # Sets the welcome channel for a guild
 async def set_welcome_channel(channelID, guildID):
-    database = await db_connect()
-    sql = ("UPDATE welcome SET welcome_channel_id = ? WHERE guild_id = ?")
-    val = (channelID, guildID)
-    return await execute_and_close(database, sql, val)
-    
+    return await set_welcome_setting('welcome_channel_id', channelID, guildID)
 
 # Sets the welcome text for a guild
 async def set_welcome_text(text, guildID):
-    database = await db_connect()
-    sql = ("UPDATE welcome SET welcome_msg = ? WHERE guild_id = ?")
-    val = (text, guildID)
-    return await execute_and_close(database, sql, val)
+    return await set_welcome_setting('welcome_msg', text, guildID)
 
 # Sets the welcome role for a guild
 async def set_welcome_role(roleID, guildID):
-    database = await db_connect()
-    sql = ("UPDATE welcome SET welcome_role_id = ? WHERE guild_id = ?")
-    val = (roleID, guildID)
-    return await execute_and_close(database, sql, val)
+    return await set_welcome_setting('welcome_role_id', roleID, guildID)
 
 # Activates or deactivates the welcome message for a guild
 async def welcome_message_switch(value, guildID):
-    database = await db_connect()
-    sql = ("UPDATE welcome SET welcome_channel_on = ? WHERE guild_id = ?")
-    val = (value, guildID)
-    return await execute_and_close(database, sql, val)
+    return await set_welcome_setting('welcome_channel_on', value, guildID)
 
 # Activates or deactivates the welcome role for a guild
 async def welcome_role_switch(value, guildID):
-    database = await db_connect()
-    sql = ("UPDATE welcome SET welcome_role_on = ? WHERE guild_id = ?")
-    val = (value, guildID)
-    return await execute_and_close(database, sql, val)
-
-# Returns the ID of the welcome channel for a guild
-async def get_welcome_channel_id(guildID):
-    database = await db_connect()
-    cursor = await database.cursor()
-    await cursor.execute(f"SELECT welcome_channel_id FROM welcome WHERE guild_id = {guildID}")
-    result = await cursor.fetchone()
-    await closeAll(database, cursor)
-    return result
+    return await set_welcome_setting('welcome_role_on', value, guildID)
 
-# Returns the value of the welcome channel switch
-async def get_welcome_channel_switch(guildID):
-    database = await db_connect()
-    cursor = await database.cursor()
-    await cursor.execute(f"SELECT welcome_channel_on FROM welcome WHERE guild_id = {guildID}")
-    result = await cursor.fetchone()
-    await closeAll(database, cursor)
-    return result
+class ReactionRoles:
+    '''In-memory index of the reaction table: message ID -> {emoji -> role ID}.
+
+    Custom emojis are indexed by their ID and unicode emojis by themselves, both as strings.
+    Reactions on messages without reaction roles are dropped with a dictionary lookup and no database access.'''
+
+    def __init__(self):
+        self._index = {}
+
+    async def load(self):
+        '''Fills the index from the reaction table, used at start-up.'''
+
+        index = {}
+        for messageID, emoji, roleID in await fetchall('SELECT message_id, emoji, role FROM reaction'):
+            index.setdefault(messageID, {})[emoji] = roleID
+        self._index = index
+
+    def get(self, messageID, emoji):
+        '''Returns the ID of the role set for emoji on a message, or None.'''
+
+        roles = self._index.get(messageID)
+        if roles is None:
+            return None
+        return roles.get(emoji)
+
+    def set(self, messageID, emoji, roleID):
+        self._index.setdefault(messageID, {})[emoji] = roleID
+
+    def discard(self, messageID, emoji):
+        roles = self._index.get(messageID)
+        if roles is not None:
+            roles.pop(emoji, None)
+            if not roles:
+                del self._index[messageID]
 
-# Returns the text of the welcome message
-async def get_welcome_message(guildID):
-    database = await db_connect()
-    cursor = await database.cursor()
-    await cursor.execute(f"SELECT welcome_msg FROM welcome WHERE guild_id = {guildID}")
-    result = await cursor.fetchone()
-    await closeAll(database, cursor)
+reaction_roles = ReactionRoles()
+
+# Sets the role given when reacting with an emoji to a message
+async def add_reaction_role(emoji, roleID, messageID, channelID, guildID):
+    sql = ("INSERT OR REPLACE INTO reaction(emoji, role, message_id, channel_id, guild_id) VALUES(?,?,?,?,?)")
+    val = (emoji, roleID, messageID, channelID, guildID)
+    result = await execute(sql, val)
+    reaction_roles.set(int(messageID), emoji, int(roleID))
     return result
 
-# Returns the value of the welcome role switch
-async def get_welcome_role_switch(guildID):
-    database = await db_connect()
-    cursor = await database.cursor()
-    await cursor.execute(f"SELECT welcome_role_on FROM welcome WHERE guild_id = {guildID}")
-    result = await cursor.fetchone()
-    await closeAll(database, cursor)
+# Removes the role given when reacting with an emoji to a message of a guild and returns the number of removed rows
+async def remove_reaction_role(emoji, messageID, guildID):
+    sql = ("DELETE FROM reaction WHERE guild_id = ? and message_id = ? and emoji = ?")
+    val = (guildID, messageID, emoji)
+    result = await execute(sql, val)
+    # The index is keyed by message only, so it is only updated when the reaction belonged to the guild.
+    if result:
+        reaction_roles.discard(int(messageID), emoji)
     return result
 
-# Returns the value of the welcome role switch
-async def get_welcome_role_id(guildID):
-    database = await db_connect()
-    cursor = await database.cursor()
-    await cursor.execute(f"SELECT welcome_role_id FROM welcome WHERE guild_id = {guildID}")
-    result = await cursor.fetchone()
-    await closeAll(database, cursor)
-    return result
\ No newline at end of file
+# Returns the maximum number of favourites of a member
+def favourites_limit():
+    return int(os.getenv('FAVOURITES_LIMIT', 10))
+
+# Returns the favourites of a member in order, as (position, uri, title, length, track, identifier) rows
+async def get_favourites(memberID):
+    sql = ("SELECT position, uri, title, length, track, identifier FROM favourites WHERE member_id = ? ORDER BY position")
+    return await fetchall(sql, (memberID, ))
+
+# Adds a track at the end of the favourites of a member. Nothing is added (0 is returned) if the list is full or has the track
+async def add_favourite(memberID, uri, title, length, track=None, identifier=None):
+    sql = ('''INSERT INTO favourites(member_id, position, uri, title, length, track, identifier)
+              SELECT :member, COALESCE((SELECT MAX(position) FROM favourites WHERE member_id = :member), 0) + 1,
+                     :uri, :title, :length, :track, :identifier
+              WHERE (SELECT COUNT(*) FROM favourites WHERE member_id = :member) < :limit
+              AND NOT EXISTS (SELECT 1 FROM favourites WHERE member_id = :member AND uri = :uri)''')
+    val = {'member': memberID, 'uri': uri, 'title': title, 'length': length, 'track': track, 'identifier': identifier,
+           'limit': favourites_limit()}
+    return await execute(sql, val)
+
+# Stores the resolved track of a favourite that only had its URL, e.g. one migrated from the old layout
+async def set_favourite_track(memberID, uri, title, length, track, identifier):
+    sql = ("UPDATE favourites SET title = ?, length = ?, track = ?, identifier = ? WHERE member_id = ? AND uri = ?")
+    val = (title, length, track, identifier, memberID, uri)
+    return await execute(sql, val)
+
+# Removes the favourite at a position (starting at 1). The following favourites move up one position
+async def remove_favourite(memberID, position):
+    sql = ("DELETE FROM favourites WHERE member_id = ? AND position = ?")
+    return await execute(sql, (memberID, position))
+
+# Moves the favourite at a position to another one, shifting the favourites in between
+async def move_favourite(memberID, source, target):
+    sql = ('''UPDATE favourites SET position = CASE WHEN position = :source THEN :target
+                                                    WHEN :source < :target THEN position - 1
+                                                    ELSE position + 1 END
+              WHERE member_id = :member AND position BETWEEN MIN(:source, :target) AND MAX(:source, :target)
+              AND MAX(:source, :target) <= (SELECT COUNT(*) FROM favourites WHERE member_id = :member)''')
+    val = {'member': memberID, 'source': source, 'target': target}
+    return await execute(sql, val)
+
+# Returns every stored music session as (guild_id, voice_channel_id, text_channel_id, message_id, dj_id, volume, paused,
+# position, track, info, requester_id) rows
+async def get_music_sessions():
+    return await fetchall("SELECT guild_id, voice_channel_id, text_channel_id, message_id, dj_id, volume, paused, position, track, info, requester_id FROM music_sessions")
+
+# Returns the stored queue of a guild in order, as (track, info, requester_id) rows
+async def get_music_queue(guildID):
+    return await fetchall("SELECT track, info, requester_id FROM music_queue WHERE guild_id = ? ORDER BY position", (guildID, ))
+
+# Stores the state of many music sessions in one transaction. queues maps a guild ID to its (track, info, requester_id) rows,
+# only the guilds whose queue changed since the last snapshot need to be given
+async def save_music_sessions(sessions, queues):
+    async with pool.acquire() as database:
+        await database.executemany('''INSERT OR REPLACE INTO music_sessions(guild_id, voice_channel_id, text_channel_id, message_id, dj_id,
+                                      volume, paused, position, track, info, requester_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', sessions)
+        for guildID, rows in queues.items():
+            await database.execute("DELETE FROM music_queue WHERE guild_id = ?", (guildID, ))
+            await database.executemany("INSERT INTO music_queue(guild_id, position, track, info, requester_id) VALUES (?, ?, ?, ?, ?)",
+                                       [(guildID, position, *row) for position, row in enumerate(rows, 1)])
+        await database.commit()
+
+# Removes the stored music session of a guild and its queue
+async def remove_music_session(guildID):
+    async with pool.acquire() as database:
+        await database.execute("DELETE FROM music_sessions WHERE guild_id = ?", (guildID, ))
+        await database.execute("DELETE FROM music_queue WHERE guild_id = ?", (guildID, ))
+        await database.commit()
+
+# Returns the custom prefixes of every guild as (guild_id, prefix) rows
+async def get_prefixes():
+    return await fetchall("SELECT guild_id, prefix FROM prefixes")
+
+# Replaces the custom prefixes of a guild. An empty list brings back the default prefixes
+async def set_prefixes(guildID, prefixes):
+    async with pool.acquire() as database:
+        await database.execute("DELETE FROM prefixes WHERE guild_id = ?", (guildID, ))
+        await database.executemany("INSERT OR IGNORE INTO prefixes(guild_id, prefix) VALUES (?, ?)", [(guildID, prefix) for prefix in prefixes])
+        await database.commit()
@@ -9,7 +9,7 @@ def embed_welcome(message, member):
     guild = member.guild
     user = member.name
     mention = member.mention
-    members = len(list(member.guild.members))
+    members = member.guild.member_count
     embed = discord.Embed(color=discord.Colour.purple(), description=message.format(members=members, mention=mention, user=user, guild=guild))
     embed.set_thumbnail(url=f'{member.avatar_url}')
     embed.set_author(name=f'{member.name}', icon_url=f'{member.avatar_url}')
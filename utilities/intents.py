@@ -0,0 +1,19 @@
+import discord
+
+def intents_profile(name):
+    '''Returns the intents, member cache flags and whether to chunk the guilds at start-up of a profile.
+
+    Keyword arguments:
+    name -- full receives and caches everything. minimal turns off presences and typing events, and only caches the members
+            in voice channels (used by the Music cog) and the ones who joined since start-up; the others are fetched when needed.'''
+
+    if name == 'minimal':
+        intents = discord.Intents.default()
+        intents.members = True # Needed by on_member_join for the welcome messages and roles.
+        intents.typing = False
+        member_cache_flags = discord.MemberCacheFlags.none()
+        member_cache_flags.voice = True
+        member_cache_flags.joined = True
+        return intents, member_cache_flags, False
+
+    return discord.Intents.all(), discord.MemberCacheFlags.all(), True
@@ -0,0 +1,248 @@
+import asyncio
+import functools
+import itertools
+import subprocess
+import threading
+import time
+
+from multiprocessing.connection import Client, Listener
+
+# Messages exchanged between the clusters and the supervisor, all of them dictionaries with an 'op' key:
+#   hello   cluster -> supervisor   first message of a cluster, with its ID
+#   request cluster -> supervisor   asks to run a command on every cluster
+#   call    supervisor -> cluster   runs a command on the cluster
+#   reply   cluster -> supervisor   result of a call
+#   result  supervisor -> cluster   results of a request, by cluster ID
+
+class Supervisor:
+    '''Starts the clusters of the bot, starts them again when they crash and relays the requests between them.
+
+    The clusters connect to a multiprocessing Listener (a Unix socket, or a named pipe on Windows) whose address and key
+    are given to them in CLUSTER_IPC_ADDRESS and CLUSTER_IPC_KEY.'''
+
+    def __init__(self, command, clusters, authkey, env=None):
+        self.command = command
+        self.clusters = clusters
+        self.authkey = authkey
+        self.env = env or {}
+        self.listener = Listener(authkey=authkey)
+
+        self.processes = {}
+        self.started = {}
+        self.delays = {}
+        self.connections = {}
+        self.requests = {}
+        self.lock = threading.RLock()
+
+    def start(self, cluster_id):
+        '''Starts the process of a cluster.'''
+
+        env = dict(self.env, **self.clusters[cluster_id])
+        env.update(CLUSTER_ID=str(cluster_id), CLUSTER_IPC_ADDRESS=str(self.listener.address), CLUSTER_IPC_KEY=self.authkey.hex())
+        self.processes[cluster_id] = subprocess.Popen(self.command, env=env)
+        self.started[cluster_id] = time.monotonic()
+
+    def run(self, restart_delay=5, max_restart_delay=300):
+        '''Starts every cluster and watches them until all of them exit on purpose (with exit code 0).
+        A cluster which crashes is started again after restart_delay seconds, doubled while it keeps crashing within a minute.'''
+
+        threading.Thread(target=self.accept, daemon=True).start()
+        for cluster_id in self.clusters:
+            self.start(cluster_id)
+
+        pending = {}
+        try:
+            while self.processes or pending:
+                time.sleep(1)
+                now = time.monotonic()
+
+                for cluster_id, process in list(self.processes.items()):
+                    code = process.poll()
+                    if code is None:
+                        continue
+                    del self.processes[cluster_id]
+                    if code == 0:
+                        print(f'Cluster {cluster_id} has shut down.')
+                        continue
+
+                    crashed_early = now - self.started[cluster_id] < 60
+                    if crashed_early and cluster_id in self.delays:
+                        delay = min(self.delays[cluster_id] * 2, max_restart_delay)
+                    else:
+                        delay = restart_delay
+                    self.delays[cluster_id] = delay
+                    pending[cluster_id] = now + delay
+                    print(f'Cluster {cluster_id} exited with code {code}, starting it again in {delay} seconds.')
+
+                for cluster_id, when in list(pending.items()):
+                    if when <= now:
+                        del pending[cluster_id]
+                        self.start(cluster_id)
+        except KeyboardInterrupt:
+            for process in self.processes.values():
+                process.terminate()
+        finally:
+            self.listener.close()
+
+    def accept(self):
+        '''Accepts the connections of the clusters, each one served by its own thread.'''
+
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                return
+            except Exception:
+                # A connection with a wrong key is refused, the listener keeps going.
+                continue
+            threading.Thread(target=self.serve, args=(connection, ), daemon=True).start()
+
+    def serve(self, connection):
+        '''Reads the messages of a cluster until it disconnects.'''
+
+        cluster_id = None
+        try:
+            hello = connection.recv()
+            cluster_id = hello['cluster']
+            with self.lock:
+                self.connections[cluster_id] = connection
+
+            while True:
+                message = connection.recv()
+                if message['op'] == 'request':
+                    self.broadcast(cluster_id, message)
+                elif message['op'] == 'reply':
+                    self.record(tuple(message['id']), cluster_id, (message['result'], message['error']))
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+            if cluster_id is not None:
+                self.disconnected(cluster_id, connection)
+
+    def send(self, connection, message):
+        with self.lock:
+            try:
+                connection.send(message)
+            except OSError:
+                pass
+
+    def broadcast(self, cluster_id, message):
+        '''Sends the command of a request to every connected cluster.'''
+
+        key = (cluster_id, message['id'])
+        with self.lock:
+            targets = dict(self.connections)
+            self.requests[key] = (set(targets), {})
+
+        for connection in targets.values():
+            self.send(connection, {'op': 'call', 'id': key, 'command': message['command'], 'args': message['args']})
+
+    def record(self, key, cluster_id, result):
+        '''Stores the reply of a cluster, answering the request once every cluster replied.'''
+
+        with self.lock:
+            request = self.requests.get(key)
+            if request is None:
+                return
+            waiting, results = request
+            results[cluster_id] = result
+            waiting.discard(cluster_id)
+            if waiting:
+                return
+            del self.requests[key]
+            requester = self.connections.get(key[0])
+
+        if requester is not None:
+            self.send(requester, {'op': 'result', 'id': key[1], 'results': results})
+
+    def disconnected(self, cluster_id, connection):
+        '''Forgets a cluster, so the requests waiting for it are answered without its reply.'''
+
+        with self.lock:
+            if self.connections.get(cluster_id) is connection:
+                del self.connections[cluster_id]
+            keys = [key for key, (waiting, _) in self.requests.items() if cluster_id in waiting]
+
+        for key in keys:
+            self.record(key, cluster_id, (None, 'The cluster disconnected.'))
+
+class ClusterClient:
+    '''Connection of a bot process to the supervisor started by launcher.py.
+
+    Commands are registered in handlers as coroutine functions. request() runs one on every cluster, this one included,
+    and returns a dictionary of cluster ID -> (result, error).'''
+
+    def __init__(self, loop, cluster_id, address, authkey):
+        self.loop = loop
+        self.cluster_id = cluster_id
+        self.address = address
+        self.authkey = authkey
+        self.handlers = {}
+
+        self._connection = None
+        self._pending = {}
+        self._ids = itertools.count()
+
+    @property
+    def is_connected(self):
+        return self._connection is not None
+
+    async def connect(self):
+        '''Connects to the supervisor. Messages are read by a background thread and handled in the event loop.'''
+
+        self._connection = await self.loop.run_in_executor(None, functools.partial(Client, self.address, authkey=self.authkey))
+        self._connection.send({'op': 'hello', 'cluster': self.cluster_id})
+        threading.Thread(target=self._read, args=(self._connection, ), daemon=True).start()
+
+    def _read(self, connection):
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                break
+            self.loop.call_soon_threadsafe(self._dispatch, message)
+        self.loop.call_soon_threadsafe(self._disconnected)
+
+    def _disconnected(self):
+        self._connection = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Lost the connection to the cluster supervisor.'))
+        self._pending.clear()
+
+    def _dispatch(self, message):
+        if message['op'] == 'call':
+            self.loop.create_task(self._call(message))
+        elif message['op'] == 'result':
+            future = self._pending.pop(message['id'], None)
+            if future is not None and not future.done():
+                future.set_result(message['results'])
+
+    async def _call(self, message):
+        handler = self.handlers.get(message['command'])
+        result = error = None
+        try:
+            if handler is None:
+                raise LookupError(f'Unknown command {message["command"]}')
+            result = await handler(*message['args'])
+        except Exception as e:
+            error = str(e)
+
+        if self._connection is not None:
+            self._connection.send({'op': 'reply', 'id': message['id'], 'result': result, 'error': error})
+
+    async def request(self, command, *args, timeout=10):
+        '''Runs a command on every cluster and returns their results. Raises asyncio.TimeoutError if they take too long.'''
+
+        if self._connection is None:
+            raise ConnectionError('Not connected to the cluster supervisor.')
+
+        request_id = next(self._ids)
+        future = self.loop.create_future()
+        self._pending[request_id] = future
+        self._connection.send({'op': 'request', 'id': request_id, 'command': command, 'args': args})
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
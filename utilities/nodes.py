@@ -0,0 +1,128 @@
+import json
+import os
+import sys
+
+nodes_path = os.path.join(f'{os.path.dirname(sys.argv[0])}/config', 'nodes.json')
+
+def load_nodes(path=nodes_path):
+    '''Reads the Lavalink nodes configuration file.
+
+    Returns a list of (node, weight) tuples, where node holds the keyword arguments of wavelink's initiate_node
+    and weight is how much load the node can take compared to the others (1 by default).'''
+
+    with open(path, encoding='utf-8') as file:
+        config = json.load(file)
+
+    nodes = []
+    for node in config['nodes']:
+        node = dict(node)
+        weight = float(node.pop('weight', 1))
+        node.setdefault('rest_uri', f'http://{node["host"]}:{node["port"]}')
+        node.setdefault('region', None)
+        nodes.append((node, weight))
+    return nodes
+
+def node_penalty(node):
+    '''Returns how loaded a node is, using the same penalties Lavalink clients use for load balancing:
+       playing players, CPU load and the frames that were not sent in time (deficit) or were empty (nulled).
+       Nodes which have not sent their stats yet are ranked by the amount of players they hold.'''
+
+    stats = node.stats
+    if stats is None:
+        return len(node.players)
+
+    penalty = stats.playing_players
+    penalty += 1.05 ** (100 * stats.system_load) * 10 - 10
+    if getattr(stats, 'frames_deficit', -1) != -1:
+        penalty += 1.03 ** (500 * (stats.frames_deficit / 3000)) * 600 - 600
+    if getattr(stats, 'frames_nulled', -1) != -1:
+        penalty += (1.03 ** (500 * (stats.frames_nulled / 3000)) * 300 - 300) * 2
+    return penalty
+
+def weighted_penalty(node, weights=None, moved=None):
+    '''Returns the penalty of a node divided by its weight.
+
+    Keyword arguments:
+    weights -- dictionary of node identifier to weight
+    moved -- dictionary of node identifier to the players moved onto (positive) or away from (negative) the node since
+             its last stats. Lavalink only sends them every minute and every playing player adds 1 to the penalty.'''
+
+    penalty = node_penalty(node)
+    # Nodes without stats are ranked by their players, which already include the moved ones.
+    if moved and node.stats is not None:
+        penalty += moved.get(node.identifier, 0)
+    return penalty / (weights or {}).get(node.identifier, 1)
+
+def is_healthy(node, max_penalty, weights=None, moved=None):
+    '''Whether a node is connected and its weighted penalty is not over max_penalty.'''
+
+    return node.is_available and weighted_penalty(node, weights, moved) <= max_penalty
+
+def select_node(nodes, weights=None, region=None, moved=None):
+    '''Returns the least loaded available node, or None when no node is available.
+
+    Keyword arguments:
+    nodes -- wavelink nodes to choose from
+    weights -- dictionary of node identifier to weight, the penalty of a node is divided by its weight
+    region -- voice region of the guild, nodes tagged with the same region are preferred
+    moved -- players moved between the nodes since their last stats, see weighted_penalty'''
+
+    available = [node for node in nodes if node.is_available]
+    if region is not None:
+        local = [node for node in available if node.region == region]
+        available = local or available
+    if not available:
+        return None
+    return min(available, key=lambda node: weighted_penalty(node, weights, moved))
+
+async def migrate_player(player, nodes, max_penalty, weights=None, region=None, moved=None):
+    '''Moves a player to the least loaded healthy node other than its own and returns it, or None when there is none.
+
+    Wavelink resumes the current track at its position with the same volume and the EQ is applied again on the new node.
+    The move is counted in moved, when given, so the next placements do not rely on stale stats.'''
+
+    old = player.node
+    candidates = [node for node in nodes if node is not old and is_healthy(node, max_penalty, weights, moved)]
+    node = select_node(candidates, weights, region, moved)
+    if node is None:
+        return None
+
+    await player.change_node(node.identifier)
+    if player.eq:
+        await player.set_eq(player.eq)
+
+    if moved is not None:
+        moved[node.identifier] = moved.get(node.identifier, 0) + 1
+        moved[old.identifier] = moved.get(old.identifier, 0) - 1
+    return node
+
+async def rebalance(nodes, move, max_penalty, weights=None):
+    '''Moves the players away from the disconnected and overloaded nodes, once. Returns the number of moved players.
+
+    Every player of a disconnected node is moved. Overloaded nodes only lose their playing players, one at a time until
+    they are healthy again. The moved players are counted, since the stats of the nodes are up to a minute old.
+    A node stops losing players as soon as one of them cannot be moved.
+
+    Keyword arguments:
+    nodes -- wavelink nodes to check
+    move -- coroutine function move(player, moved) returning whether the player was moved, e.g. around migrate_player
+    max_penalty -- weighted penalty over which a node is overloaded
+    weights -- dictionary of node identifier to weight'''
+
+    moved = {}
+    count = 0
+    for node in list(nodes):
+        if not node.players or is_healthy(node, max_penalty, weights, moved):
+            continue
+
+        for player in list(node.players.values()):
+            # Checked for every player, the node might disconnect during the pass.
+            if node.is_available:
+                if is_healthy(node, max_penalty, weights, moved):
+                    break
+                if not player.is_playing:
+                    continue
+            if not await move(player, moved):
+                break
+            count += 1
+    return count
@@ -0,0 +1,85 @@
+import re
+
+from utilities.db import get_prefixes, set_prefixes
+
+# Prefixes of the guilds which did not set their own. Notice how you can use spaces in prefixes, try to keep them simple though.
+default_prefixes = ('!', '? ', '.')
+max_prefixes = 10
+max_prefix_length = 10
+
+def compile_prefixes(prefixes, user_id):
+    '''Compiles the prefixes of a guild and the mentions of the bot into a single regex anchored at the start of a message.
+       Longer prefixes are tried first, so a prefix never shadows a longer one which starts with it.'''
+
+    alternatives = [f'<@!?{user_id}> '] + [re.escape(prefix) for prefix in sorted(prefixes, key=len, reverse=True)]
+    return re.compile('|'.join(alternatives))
+
+class GuildPrefixes:
+    '''Custom prefixes of the guilds, loaded once from the database, and their compiled matchers.
+
+    Matchers are compiled the first time a guild needs one and again only when its prefixes change.
+    Guilds without custom prefixes share the matcher of the default prefixes.'''
+
+    def __init__(self, defaults=default_prefixes):
+        self.defaults = tuple(defaults)
+        self._prefixes = {}
+        self._matchers = {}
+        self._default_matcher = None
+        self._user_id = None
+
+    async def load(self):
+        '''Reads the custom prefixes of every guild, used at start-up.'''
+
+        prefixes = {}
+        for guildID, prefix in await get_prefixes():
+            prefixes.setdefault(guildID, []).append(prefix)
+        self._prefixes = {guildID: tuple(values) for guildID, values in prefixes.items()}
+        self._matchers.clear()
+
+    def get(self, guildID):
+        '''Returns the prefixes of a guild.'''
+
+        return self._prefixes.get(guildID, self.defaults)
+
+    def matcher(self, guildID, user_id):
+        '''Returns the compiled matcher of a guild.'''
+
+        if user_id != self._user_id:
+            # The mentions of the bot are part of every matcher.
+            self._user_id = user_id
+            self._matchers.clear()
+            self._default_matcher = None
+
+        if guildID not in self._prefixes:
+            if self._default_matcher is None:
+                self._default_matcher = compile_prefixes(self.defaults, user_id)
+            return self._default_matcher
+
+        matcher = self._matchers.get(guildID)
+        if matcher is None:
+            matcher = self._matchers[guildID] = compile_prefixes(self._prefixes[guildID], user_id)
+        return matcher
+
+    def match(self, guildID, user_id, content):
+        '''Returns the prefix (or mention) which starts content, or None.'''
+
+        match = self.matcher(guildID, user_id).match(content)
+        return match.group() if match else None
+
+    async def set(self, guildID, prefixes):
+        '''Replaces the prefixes of a guild, in the database and in memory. No prefixes bring back the default ones.'''
+
+        prefixes = tuple(dict.fromkeys(prefixes))
+        await set_prefixes(guildID, prefixes)
+        if prefixes:
+            self._prefixes[guildID] = prefixes
+        else:
+            self._prefixes.pop(guildID, None)
+        self._matchers.pop(guildID, None)
+
+    async def clear(self, guildID):
+        '''Forgets the custom prefixes of a guild.'''
+
+        await self.set(guildID, ())
+
+guild_prefixes = GuildPrefixes()
@@ -0,0 +1,98 @@
+import asyncio
+import collections
+import itertools
+import random
+
+class TrackQueue:
+    '''Queue of the tracks of a player, backed by a deque.
+       Adding and taking tracks at the ends is O(1), and the tracks can be indexed, removed, moved and shuffled in place.
+       version increases on every change, so a copy of the queue can tell whether it is out of date.'''
+
+    def __init__(self):
+        self._tracks = collections.deque()
+        self._not_empty = asyncio.Event()
+        self.version = 0
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def __iter__(self):
+        return iter(self._tracks)
+
+    def __getitem__(self, index):
+        return self._tracks[index]
+
+    def __setitem__(self, index, track):
+        self._tracks[index] = track
+        self._changed()
+
+    def _changed(self):
+        self.version += 1
+        if self._tracks:
+            self._not_empty.set()
+        else:
+            self._not_empty.clear()
+
+    def put(self, track):
+        '''Adds a track at the end of the queue.'''
+
+        self._tracks.append(track)
+        self._changed()
+
+    def extend(self, tracks):
+        '''Adds many tracks at the end of the queue in a single operation. tracks can be any iterable, e.g. a generator.'''
+
+        self._tracks.extend(tracks)
+        self._changed()
+
+    async def get(self):
+        '''Takes the first track of the queue, waiting until there is one.'''
+
+        while not self._tracks:
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+    def get_nowait(self):
+        '''Takes the first track of the queue. Raises IndexError if it is empty.'''
+
+        track = self._tracks.popleft()
+        self._changed()
+        return track
+
+    def remove(self, index):
+        '''Removes and returns the track at index.'''
+
+        track = self._tracks[index]
+        del self._tracks[index]
+        self._changed()
+        return track
+
+    def move(self, source, target):
+        '''Moves the track at source to target, shifting the tracks in between.'''
+
+        track = self._tracks[source]
+        del self._tracks[source]
+        self._tracks.insert(target, track)
+        self._changed()
+
+    def skip_to(self, index):
+        '''Drops the tracks before index, so the track at index is the next one.'''
+
+        for _ in range(index):
+            self._tracks.popleft()
+        self._changed()
+
+    def shuffle(self):
+        '''Shuffles the queue in place.'''
+
+        random.shuffle(self._tracks)
+        self._changed()
+
+    def clear(self):
+        self._tracks.clear()
+        self._changed()
+
+    def page(self, start, stop):
+        '''Returns the tracks between start and stop without copying the rest of the queue.'''
+
+        return list(itertools.islice(self._tracks, start, stop))
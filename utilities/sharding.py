@@ -0,0 +1,31 @@
+def shard_id(guild_id, shard_count):
+    '''Returns the shard which receives the events of a guild, as computed by Discord.'''
+
+    return (guild_id >> 22) % shard_count
+
+def handles_guild(bot, guild_id):
+    '''Whether the guild belongs to one of the shards run by this process.
+       Processes started without sharding handle every guild.'''
+
+    if not bot.shard_count:
+        return True
+
+    shard_ids = getattr(bot, 'shard_ids', None)
+    if shard_ids is None:
+        return True
+    return shard_id(guild_id, bot.shard_count) in shard_ids
+
+def cluster_shards(shard_count, clusters):
+    '''Splits the shards into the given amount of clusters, as evenly as possible and keeping consecutive shards together.
+
+    Returns a list holding the shard IDs of each cluster. No cluster is left empty.'''
+
+    clusters = max(1, min(clusters, shard_count))
+    size, extra = divmod(shard_count, clusters)
+
+    result, start = [], 0
+    for cluster in range(clusters):
+        end = start + size + (1 if cluster < extra else 0)
+        result.append(list(range(start, end)))
+        start = end
+    return result